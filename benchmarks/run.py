@@ -0,0 +1,316 @@
+"""Benchmarks the authentication path.
+
+Each benchmark times one operation, e.g. verifying a token or authenticating
+a request end to end, and reports its throughput and latency percentiles.
+The JWKS and permission endpoints are served by a local stub server, so the
+benchmarks run offline.
+
+Usage:
+    python benchmarks/run.py [-n ITERATIONS] [-o results.json]
+        [--compare previous.json] [BENCHMARK ...]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings  # noqa: E402
+
+settings.configure(
+    ALLOWED_HOSTS=['*'],
+    JWT_AUTH={},
+)
+
+import jwt  # noqa: E402
+from django.http import HttpRequest  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+import jwt_auth.jwt  # noqa: E402
+from jwt_auth.authentication import JWTAuthentication  # noqa: E402
+from jwt_auth.conf import build_config, get_config  # noqa: E402
+from jwt_auth.jwks import Jwks  # noqa: E402
+from jwt_auth.jwt import JWT, parse  # noqa: E402
+from jwt_auth.stub_server import StubServer  # noqa: E402
+
+SECRETS = ['secret-%d' % index for index in range(20)]
+SERVICE_TOKEN = 'benchmark'
+SERVER = StubServer(service_token=SERVICE_TOKEN)
+
+# Benchmarks by name, each returning the operation to time.
+BENCHMARKS: Dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def benchmark(function):
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def make_payload() -> dict:
+    return {
+        'uuid': str(uuid4()),
+        'email': 'user@example.com',
+        'exp': int(time.time()) + 3600,
+    }
+
+
+def make_hs256(secret: str = SECRETS[-1], **headers) -> str:
+    return jwt.encode(
+        make_payload(), secret, 'HS256', headers=headers,
+    ).decode()
+
+
+def make_rs256() -> str:
+    return SERVER.sign(make_payload())
+
+
+def make_request(token: str) -> HttpRequest:
+    request = HttpRequest()
+    request.META['HTTP_AUTHORIZATION'] = 'JWT ' + token
+    return request
+
+
+def jwt_auth_settings(**overrides) -> override_settings:
+    values = {
+        'KEYS': SECRETS[:1],
+        'PERMISSION_ENDPOINT': SERVER.url + '/permissions',
+        'PERMISSION_BULK_ENDPOINT': SERVER.url + '/permissions/bulk',
+        'JWKS_ENDPOINT': SERVER.url + '/jwks',
+        'SERVICE_SECRET_TOKEN': SERVICE_TOKEN,
+    }
+    values.update(overrides)
+    return override_settings(JWT_AUTH=values)
+
+
+@benchmark
+def parse_token():
+    token = make_hs256()
+    return lambda: parse(token)
+
+
+def _hs256(key_count: int):
+    token = make_hs256(SECRETS[key_count - 1])
+    keys = get_config().keys
+    return lambda: JWT(token, keys).payload
+
+
+@benchmark
+def hs256_1_key():
+    return _hs256(1)
+
+
+@benchmark
+def hs256_5_keys():
+    return _hs256(5)
+
+
+@benchmark
+def hs256_20_keys():
+    return _hs256(20)
+
+
+@benchmark
+def hs256_20_named_keys():
+    token = make_hs256(SECRETS[-1], kid='key-19')
+    keys = build_config({
+        'KEYS': {'key-%d' % index: secret
+                 for index, secret in enumerate(SECRETS)},
+    }).keys
+    return lambda: JWT(token, keys).payload
+
+
+@benchmark
+def hs256_token_cache_warm():
+    token = make_hs256(SECRETS[0])
+    keys = get_config().keys
+    return lambda: JWT(token, keys).payload
+
+
+@benchmark
+def rs256_jwks_warm():
+    token = make_rs256()
+    keys = get_config().keys
+    jwt_auth.jwt.JWKS = Jwks()
+    return lambda: JWT(token, keys).payload
+
+
+@benchmark
+def rs256_jwks_cold():
+    token = make_rs256()
+    keys = get_config().keys
+
+    def operation():
+        # A new key set cache has to fetch the key set first.
+        jwt_auth.jwt.JWKS = Jwks()
+        return JWT(token, keys).payload
+    return operation
+
+
+@benchmark
+def permission_fetch():
+    uuid = str(uuid4())
+    return lambda: JWTAuthentication._fetch_authorization(uuid)
+
+
+@benchmark
+def authenticate_hs256():
+    request = make_request(make_hs256(SECRETS[0]))
+    return lambda: JWTAuthentication().authenticate(request)
+
+
+@benchmark
+def authenticate_hs256_cached():
+    request = make_request(make_hs256(SECRETS[0]))
+    return lambda: JWTAuthentication().authenticate(request)
+
+
+@benchmark
+def authenticate_rs256():
+    # Both caches are off, so each request verifies the signature and
+    # fetches the authorization data.
+    request = make_request(make_rs256())
+    jwt_auth.jwt.JWKS = Jwks()
+    return lambda: JWTAuthentication().authenticate(request)
+
+
+@benchmark
+def authenticate_rs256_cached():
+    request = make_request(make_rs256())
+    jwt_auth.jwt.JWKS = Jwks()
+    return lambda: JWTAuthentication().authenticate(request)
+
+
+# Settings of the benchmarks that do not use the defaults above.
+SETTINGS: Dict[str, Dict[str, Any]] = {
+    'hs256_1_key': {'KEYS': SECRETS[:1]},
+    'hs256_5_keys': {'KEYS': SECRETS[:5]},
+    'hs256_20_keys': {'KEYS': SECRETS},
+    'hs256_token_cache_warm': {'TOKEN_CACHE_SIZE': 1000},
+    'authenticate_hs256_cached': {
+        'TOKEN_CACHE_SIZE': 1000,
+        'AUTHORIZATION_CACHE_TTL': 60,
+    },
+    'authenticate_rs256_cached': {
+        'TOKEN_CACHE_SIZE': 1000,
+        'AUTHORIZATION_CACHE_TTL': 60,
+    },
+}
+
+
+def percentile(timings: List[float], fraction: float) -> float:
+    """Get a percentile of sorted timings, by the nearest rank."""
+    index = max(int(round(fraction * len(timings))) - 1, 0)
+    return timings[min(index, len(timings) - 1)]
+
+
+def run(name: str, iterations: int) -> dict:
+    """Time a benchmark.
+
+    Args:
+        name: The name of the benchmark.
+        iterations: The number of timed operations.
+
+    Returns:
+        The throughput, in operations per second, and latencies, in
+        microseconds, of the benchmark.
+    """
+    jwks = jwt_auth.jwt.JWKS
+    try:
+        with jwt_auth_settings(**SETTINGS.get(name, {})):
+            operation = BENCHMARKS[name]()
+            for _ in range(max(iterations // 10, 1)):
+                operation()
+
+            timings = []
+            started = time.perf_counter()
+            for _ in range(iterations):
+                start = time.perf_counter()
+                operation()
+                timings.append(time.perf_counter() - start)
+            elapsed = time.perf_counter() - started
+    finally:
+        jwt_auth.jwt.JWKS = jwks
+
+    timings.sort()
+    return {
+        'name': name,
+        'iterations': iterations,
+        'ops_per_second': iterations / elapsed,
+        'mean_us': statistics.mean(timings) * 1e6,
+        'p50_us': percentile(timings, 0.5) * 1e6,
+        'p99_us': percentile(timings, 0.99) * 1e6,
+        'max_us': timings[-1] * 1e6,
+    }
+
+
+def report(results: List[dict], previous: Optional[dict] = None) -> None:
+    """Print the results, compared to previous ones if given."""
+    results_before = (previous or {}).get('results', [])
+    baseline = {result['name']: result for result in results_before}
+    print('%-28s %12s %10s %10s %10s' % (
+        'benchmark', 'ops/s', 'p50 us', 'p99 us', 'change',
+    ))
+    for result in results:
+        change = ''
+        before = baseline.get(result['name'])
+        if before:
+            change = '%+.1f%%' % (
+                (result['ops_per_second'] / before['ops_per_second'] - 1) * 100
+            )
+        print('%-28s %12.0f %10.1f %10.1f %10s' % (
+            result['name'], result['ops_per_second'], result['p50_us'],
+            result['p99_us'], change,
+        ))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        'benchmarks', nargs='*', metavar='BENCHMARK',
+        help='the benchmarks to run, all by default: %s' % ', '.join(
+            BENCHMARKS,
+        ),
+    )
+    parser.add_argument(
+        '-n', '--iterations', type=int, default=1000,
+        help='the number of timed operations per benchmark',
+    )
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='compare to previous JSON results')
+    args = parser.parse_args(argv)
+
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+
+    SERVER.start()
+    try:
+        results = [run(name, args.iterations) for name in names]
+    finally:
+        SERVER.stop()
+
+    report(results, previous)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': time.time(),
+                'results': results,
+            }, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
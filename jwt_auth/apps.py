@@ -7,3 +7,22 @@ class JWTAuthConfig(AppConfig):
     """Configuration for the auth app
     """
     name = 'jwt_auth'
+
+    def ready(self):
+        """Validate the settings, set up the metrics collector and start the
+        background JWKS refresher.
+
+        Invalid settings raise `ImproperlyConfigured` at startup rather than
+        on the first request.
+        """
+        from django.utils.module_loading import import_string
+
+        from jwt_auth.conf import load_config
+        from jwt_auth.jwt import JWKS
+        from jwt_auth.metrics import set_collector
+
+        config = load_config()
+        if config.metrics_collector:
+            set_collector(import_string(config.metrics_collector)())
+        if config.jwks_background_refresh:
+            JWKS.start()
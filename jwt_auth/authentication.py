@@ -1,22 +1,186 @@
 """Provides a custom authentication class for JWT based authentication."""
+import asyncio
 import logging
-from typing import Union
+import time
+from functools import partial
+from typing import (
+    Any, Callable, Dict, Iterable, List, Optional, Sequence, Union,
+)
 from uuid import UUID
 
-import requests
-
+from asgiref.sync import sync_to_async
 from django.http import HttpRequest
-from django.conf import settings
 
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 
-from jwt_auth.jwt import JWT
+from jwt_auth import metrics
+from jwt_auth.cache import AuthorizationCache
+from jwt_auth.circuit_breaker import CircuitBreaker, CircuitOpenError
+from jwt_auth.concurrency import AsyncSingleFlight, MicroBatcher, SingleFlight
+from jwt_auth.conf import get_config
+from jwt_auth.jwt import JWT, verify_many
 from jwt_auth.models import User
 from jwt_auth.service_authorization import ServiceRequestAuth
+from jwt_auth.session import get_async_client, get_session
+
+
+logger = logging.getLogger(__name__)
+
+# Users' authorization data keyed by uuid, see `AUTHORIZATION_CACHE_TTL`.
+AUTHORIZATION_CACHE = AuthorizationCache()
+
+# Concurrent lookups of the same user's authorization data share one request.
+AUTHORIZATION_FLIGHTS = SingleFlight()
+ASYNC_AUTHORIZATION_FLIGHTS = AsyncSingleFlight()
+
+# Lookups of different users share bulk requests, see
+# `PERMISSION_BATCH_WINDOW`.
+AUTHORIZATION_BATCHER = MicroBatcher(
+    lambda uuid_strings: _call_permission_endpoint(
+        JWTAuthentication._fetch_authorizations, uuid_strings,
+    ),
+)
+
+
+def _is_endpoint_failure(ex: Exception) -> bool:
+    """Tell whether an error means the permission endpoint is down, rather
+    than e.g. that the user is unknown."""
+    response = getattr(ex, 'response', None)
+    return response is None or response.status_code >= 500
+
+
+def _may_serve_stale(ex: Exception) -> bool:
+    """Tell whether stale data may be served after an error.
+
+    Only failures of the endpoint qualify: a user that is unknown to it, or
+    whose access was revoked, must not keep authenticating with stale data.
+    """
+    if isinstance(ex, CircuitOpenError):
+        return True
+    # A user missing from the results of a batch is unknown to the endpoint.
+    return not isinstance(ex, KeyError) and _is_endpoint_failure(ex)
 
 
-logger = logging.getLogger()
+# Fails fast while the permission endpoints are down, see
+# `PERMISSION_CIRCUIT_FAILURES`.
+PERMISSION_CIRCUIT = CircuitBreaker(
+    'permission', is_failure=_is_endpoint_failure,
+)
+
+
+def _get_authorization_cache() -> Optional[AuthorizationCache]:
+    """Get the authorization cache, if it is enabled in the settings."""
+    config = get_config()
+    if not config.authorization_cache_ttl:
+        return None
+    AUTHORIZATION_CACHE.ttl = config.authorization_cache_ttl
+    AUTHORIZATION_CACHE.stale_ttl = config.authorization_cache_stale_ttl
+    AUTHORIZATION_CACHE.local.stale_ttl = config.authorization_cache_stale_ttl
+    AUTHORIZATION_CACHE.alias = config.authorization_cache_alias
+    AUTHORIZATION_CACHE.local_enabled = bool(config.authorization_cache_size)
+    AUTHORIZATION_CACHE.local.max_entries = config.authorization_cache_size
+    return AUTHORIZATION_CACHE
+
+
+def _get_authorization_batcher() -> Optional[MicroBatcher]:
+    """Get the authorization batcher, if it is enabled in the settings."""
+    config = get_config()
+    if not config.permission_batch_window \
+            or not config.permission_bulk_endpoint:
+        return None
+    AUTHORIZATION_BATCHER.window = config.permission_batch_window
+    AUTHORIZATION_BATCHER.max_size = config.permission_bulk_size
+    return AUTHORIZATION_BATCHER
+
+
+def _get_permission_circuit() -> Optional[CircuitBreaker]:
+    """Get the permission circuit breaker, if it is enabled in the settings.
+    """
+    config = get_config()
+    if not config.permission_circuit_failures:
+        return None
+    PERMISSION_CIRCUIT.failure_threshold = config.permission_circuit_failures
+    PERMISSION_CIRCUIT.reset_timeout = config.permission_circuit_reset
+    return PERMISSION_CIRCUIT
+
+
+def _call_permission_endpoint(function: Callable, *args) -> Any:
+    """Call a permission endpoint through the circuit breaker, if enabled."""
+    circuit = _get_permission_circuit()
+    if circuit is None:
+        return function(*args)
+    return circuit.call(partial(function, *args))
+
+
+async def _acall_permission_endpoint(function: Callable, *args) -> Any:
+    """Await a permission endpoint through the circuit breaker, if enabled.
+    """
+    circuit = _get_permission_circuit()
+    if circuit is None:
+        return await function(*args)
+    return await circuit.acall(partial(function, *args))
+
+
+def _get_embedded_authorization(payload: dict) -> Optional[dict]:
+    """Get the authorization data embedded in a verified payload.
+
+    The data is read from the `AUTHORIZATION_CLAIM` claim, if the token was
+    issued less than `AUTHORIZATION_CLAIM_MAX_AGE` seconds ago.
+
+    Args:
+        payload: The verified payload, which is not modified.
+
+    Returns:
+        The authorization data, or None if it must be fetched.
+    """
+    config = get_config()
+    if not config.authorization_claim:
+        return None
+
+    authorization = payload.get(config.authorization_claim)
+    if not isinstance(authorization, dict) or not all(
+            name in authorization
+            for name in ('is_active', 'role', 'subscription')
+    ):
+        return None
+
+    max_age = config.authorization_claim_max_age
+    if max_age:
+        try:
+            issued_at = int(payload['iat'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if time.time() - issued_at > max_age:
+            logger.debug('Authorization claim is too old.')
+            return None
+
+    metrics.increment('authorization_claims_used_total')
+    return authorization
+
+
+def _get_stale_authorizations(
+        uuid_strings: List[str],
+        cache: Optional[AuthorizationCache],
+) -> Dict[str, dict]:
+    """Get the authorization data to serve while the endpoint is failing.
+
+    Args:
+        uuid_strings: The uuids of the users.
+        cache: The authorization cache, if enabled.
+
+    Returns:
+        The stale authorization data by uuid, or nothing unless all the
+        users have some.
+    """
+    if cache is None or not cache.stale_ttl:
+        return {}
+    stale = cache.get_stale_many(uuid_strings)
+    if len(stale) < len(set(uuid_strings)):
+        return {}
+    logger.warning('Serving stale authorization data of %d users.', len(stale))
+    metrics.increment('authorization_stale_served_total', len(stale))
+    return stale
 
 
 class JWTAuthentication(BaseAuthentication):
@@ -39,6 +203,7 @@ class JWTAuthentication(BaseAuthentication):
                 user = self._get_user(token)
             except Exception:
                 logger.debug('JWT Authentication Failed')
+                metrics.increment('authentication_failures_total')
                 raise AuthenticationFailed()
             return user, token
         else:
@@ -58,6 +223,148 @@ class JWTAuthentication(BaseAuthentication):
         host = host.replace('www.', '')
         return 'aps.{host}/user/accounts/login/'.format(host=host)
 
+    @classmethod
+    def authenticate_tokens(
+            cls,
+            tokens: Sequence[str],
+    ) -> List[Union[User, AuthenticationFailed]]:
+        """Authenticate several JWTs at once
+
+        The tokens are verified with `verify_many` and the authorization
+        data of the users without an authorization claim is fetched with
+        `get_authorizations`.
+
+        Args:
+            tokens: The JWTs.
+
+        Returns:
+            The user of each token, in order, or `AuthenticationFailed` for
+            the tokens that could not be authenticated.
+        """
+        payloads = verify_many(tokens)
+        users = [cls._make_user(payload) for payload in payloads]
+        embedded = [
+            _get_embedded_authorization(payload)
+            if user is not None and isinstance(payload, dict) else None
+            for user, payload in zip(users, payloads)
+        ]
+
+        try:
+            authorizations = cls.get_authorizations(
+                user.id for user, authorization in zip(users, embedded)
+                if user is not None and authorization is None
+            )
+        except Exception as ex:
+            logger.debug(str(ex))
+            authorizations = {}
+
+        results = []
+        for user, authorization in zip(users, embedded):
+            try:
+                if user is None:
+                    raise ValueError('Invalid token.')
+                if authorization is None:
+                    authorization = authorizations[str(user.id)]
+                user.set_authorization(authorization)
+            except Exception:
+                logger.debug('JWT Authentication Failed')
+                results.append(AuthenticationFailed())
+            else:
+                results.append(user)
+        return results
+
+    @classmethod
+    def get_authorizations(
+            cls,
+            user_ids: Iterable[Union[str, UUID]],
+    ) -> Dict[str, dict]:
+        """Get the authorization data of several users
+
+        Cached users are not fetched again. The others are fetched from the
+        PERMISSION_BULK_ENDPOINT, in chunks of PERMISSION_BULK_SIZE users, or
+        one by one from the PERMISSION_ENDPOINT if it is not configured. A
+        failed request only affects the users it was for.
+
+        Args:
+            user_ids: The ids of the users.
+
+        Returns:
+            The authorization data by uuid. Users that are unknown, or could
+            not be fetched, are left out.
+        """
+        uuid_strings = list(dict.fromkeys(map(str, user_ids)))
+        cache = _get_authorization_cache()
+        authorizations = {}
+        if cache is not None:
+            authorizations = cache.get_many(uuid_strings)
+
+        missing = [
+            uuid_string for uuid_string in uuid_strings
+            if uuid_string not in authorizations
+        ]
+        if not missing:
+            return authorizations
+
+        config = get_config()
+        if not config.permission_bulk_endpoint:
+            for uuid_string in missing:
+                try:
+                    authorizations[uuid_string] = AUTHORIZATION_FLIGHTS.do(
+                        uuid_string,
+                        partial(cls._load_authorization, uuid_string, cache),
+                    )
+                except Exception as ex:
+                    logger.warning(
+                        'Failed to get the authorization data of %s: %s',
+                        uuid_string, ex,
+                    )
+            return authorizations
+
+        size = max(config.permission_bulk_size, 1)
+        for start in range(0, len(missing), size):
+            chunk = missing[start:start + size]
+            try:
+                fetched = _call_permission_endpoint(
+                    cls._fetch_authorizations, chunk,
+                )
+            except Exception as ex:
+                logger.warning(
+                    'Failed to get the authorization data of %d users: %s',
+                    len(chunk), ex,
+                )
+                if _may_serve_stale(ex):
+                    authorizations.update(
+                        _get_stale_authorizations(chunk, cache),
+                    )
+                continue
+
+            if cache is not None and fetched:
+                cache.set_many(fetched)
+            authorizations.update(fetched)
+        return authorizations
+
+    @staticmethod
+    def _make_user(payload: Union[dict, Exception]) -> Optional[User]:
+        """Make the user represented by a verified payload
+
+        Args:
+            payload: The payload, or the error raised verifying the token.
+
+        Returns:
+            The user without authorization data, or None if the token is
+            invalid.
+        """
+        if isinstance(payload, Exception):
+            logger.debug(str(payload))
+            return None
+        try:
+            user = User(**payload)  # payload must have uuid and email.
+            user.id  # Validate the uuid, which is parsed lazily.
+        except Exception as ex:
+            logger.debug(str(ex))
+            return None
+        return user
+
     @classmethod
     def _get_user(cls, token: str) -> User:
         """Get the user represented by the given JWT.
@@ -68,26 +375,27 @@ class JWTAuthentication(BaseAuthentication):
         Returns:
             The user who made the request
         """
-        keys = settings.JWT_AUTH.get('KEYS', [])
-
-        jwt = JWT(token, keys)
+        jwt = JWT(token, get_config().keys)
 
         try:
             user = User(**jwt.payload)  # payload must have uuid and email.
+            user.id  # Validate the uuid, which is parsed lazily.
             logger.debug('Extracted user.')
         except Exception as ex:
             logger.debug(str(ex))
             raise ex
 
-        authorization = cls._get_authorization(user.id)
+        authorization = _get_embedded_authorization(jwt.payload)
+        if authorization is None:
+            authorization = cls._get_authorization(user.id)
         logger.debug('Authorization completed.')
 
         user.set_authorization(authorization)
 
         return user
 
-    @staticmethod
-    def _get_authorization(user_id: UUID) -> dict:
+    @classmethod
+    def _get_authorization(cls, user_id: UUID) -> dict:
         """Get the user's authorization data
 
         Args:
@@ -96,16 +404,109 @@ class JWTAuthentication(BaseAuthentication):
         Returns:
             The authorization data.
         """
-        url = settings.JWT_AUTH['PERMISSION_ENDPOINT']
         uuid_string = str(user_id)
-        response = requests.get(
-            url,
-            params={'uuid': uuid_string},
-            auth=ServiceRequestAuth(),
+        cache = _get_authorization_cache()
+        if cache is not None:
+            authorization = cache.get(uuid_string)
+            if authorization is not None:
+                return authorization
+
+        return AUTHORIZATION_FLIGHTS.do(
+            uuid_string,
+            partial(cls._load_authorization, uuid_string, cache),
         )
+
+    @classmethod
+    def _load_authorization(
+            cls,
+            uuid_string: str,
+            cache: Optional[AuthorizationCache],
+    ) -> dict:
+        """Fetch the user's authorization data and cache it
+
+        Stale data is served if the endpoint fails, see
+        `AUTHORIZATION_CACHE_STALE_TTL`.
+
+        Args:
+            uuid_string: The uuid of the user.
+            cache: The authorization cache, if enabled.
+
+        Returns:
+            The authorization data.
+        """
+        try:
+            batcher = _get_authorization_batcher()
+            if batcher is not None:
+                authorization = batcher.submit(uuid_string).result()
+            else:
+                authorization = _call_permission_endpoint(
+                    cls._fetch_authorization, uuid_string,
+                )
+        except Exception as ex:
+            if not _may_serve_stale(ex):
+                raise
+            stale = _get_stale_authorizations([uuid_string], cache)
+            if not stale:
+                raise
+            return stale[uuid_string]
+
+        if cache is not None:
+            cache.set(uuid_string, authorization)
+        return authorization
+
+    @staticmethod
+    def _fetch_authorization(uuid_string: str) -> dict:
+        """Get the user's authorization data from the PERMISSION_ENDPOINT
+
+        Args:
+            uuid_string: The uuid of the user.
+
+        Returns:
+            The authorization data.
+        """
+        config = get_config()
+        with metrics.timer('permission_fetch_seconds'):
+            response = get_session().get(
+                config.permission_endpoint,
+                params={'uuid': uuid_string},
+                auth=ServiceRequestAuth(),
+                timeout=config.permission_timeout,
+            )
         response.raise_for_status()
         return response.json()
 
+    @staticmethod
+    def _fetch_authorizations(uuid_strings: List[str]) -> Dict[str, dict]:
+        """Get several users' authorization data from the bulk endpoint
+
+        Args:
+            uuid_strings: The uuids of the users.
+
+        Returns:
+            The authorization data by uuid.
+        """
+        config = get_config()
+        size = max(config.permission_bulk_size, 1)
+        session = get_session()
+        authorizations: Dict[str, dict] = {}
+        for start in range(0, len(uuid_strings), size):
+            chunk = uuid_strings[start:start + size]
+            with metrics.timer('permission_bulk_fetch_seconds'):
+                response = session.get(
+                    config.permission_bulk_endpoint,
+                    params={'uuid': chunk},
+                    auth=ServiceRequestAuth(),
+                    timeout=config.permission_timeout,
+                )
+            response.raise_for_status()
+            data = response.json()
+            authorizations.update(
+                (uuid_string, data[uuid_string])
+                for uuid_string in chunk
+                if data.get(uuid_string) is not None
+            )
+        return authorizations
+
     @staticmethod
     def _get_token(request: HttpRequest) -> Union[str, None]:
         """Get the JWT.
@@ -122,6 +523,168 @@ class JWTAuthentication(BaseAuthentication):
         return None
 
 
+class AsyncJWTAuthentication(JWTAuthentication):
+    """Authenticate requests with JWTs without blocking the event loop
+
+    The token, JWKS and authorization caches are shared with
+    `JWTAuthentication`. Tokens are verified in the event loop's default
+    executor, which also fetches the JWKS when needed, and the authorization
+    data is fetched with the optional `httpx` dependency.
+
+    DRF only calls `authenticate`, which blocks, so `aauthenticate` must be
+    awaited by the caller, e.g. an async middleware or view.
+    """
+
+    async def aauthenticate(
+            self,
+            request: HttpRequest,
+    ) -> Union[tuple, None]:
+        """Used to authenticate the user
+
+        Args:
+            request: The request object. Must contain a headers `dict`.
+
+        Returns:
+            The `user` and `auth` for the request. Or None if JWT was not used.
+        """
+        logger.debug('Async JWT Authentication')
+        token = self._get_token(request)
+        if token:
+            try:
+                user = await self._aget_user(token)
+            except Exception:
+                logger.debug('JWT Authentication Failed')
+                metrics.increment('authentication_failures_total')
+                raise AuthenticationFailed()
+            return user, token
+        else:
+            logger.debug('No token')
+        return None
+
+    @classmethod
+    async def _aget_user(cls, token: str) -> User:
+        """Get the user represented by the given JWT.
+
+        Args:
+            token: The JWT.
+
+        Returns:
+            The user who made the request
+        """
+        jwt = JWT(token, get_config().keys)
+
+        loop = asyncio.get_running_loop()
+        payload = await loop.run_in_executor(None, lambda: jwt.payload)
+        user = User(**payload)  # payload must have uuid and email.
+        user.id  # Validate the uuid, which is parsed lazily.
+        logger.debug('Extracted user.')
+
+        authorization = _get_embedded_authorization(payload)
+        if authorization is None:
+            authorization = await cls._aget_authorization(user.id)
+        logger.debug('Authorization completed.')
+
+        user.set_authorization(authorization)
+
+        return user
+
+    @classmethod
+    async def _aget_authorization(cls, user_id: UUID) -> dict:
+        """Get the user's authorization data
+
+        Args:
+            user_id: The id for the user who's authorization we want.
+
+        Returns:
+            The authorization data.
+        """
+        uuid_string = str(user_id)
+        cache = _get_authorization_cache()
+        if cache is not None:
+            if cache.alias:
+                # The shared cache may do blocking I/O.
+                authorization = await sync_to_async(
+                    cache.get, thread_sensitive=False,
+                )(uuid_string)
+            else:
+                authorization = cache.get(uuid_string)
+            if authorization is not None:
+                return authorization
+
+        return await ASYNC_AUTHORIZATION_FLIGHTS.do(
+            uuid_string,
+            partial(cls._aload_authorization, uuid_string, cache),
+        )
+
+    @classmethod
+    async def _aload_authorization(
+            cls,
+            uuid_string: str,
+            cache: Optional[AuthorizationCache],
+    ) -> dict:
+        """Fetch the user's authorization data and cache it
+
+        Stale data is served if the endpoint fails, see
+        `AUTHORIZATION_CACHE_STALE_TTL`.
+
+        Args:
+            uuid_string: The uuid of the user.
+            cache: The authorization cache, if enabled.
+
+        Returns:
+            The authorization data.
+        """
+        try:
+            batcher = _get_authorization_batcher()
+            if batcher is not None:
+                authorization = await asyncio.wrap_future(
+                    batcher.submit(uuid_string),
+                )
+            else:
+                authorization = await _acall_permission_endpoint(
+                    cls._afetch_authorization, uuid_string,
+                )
+        except Exception as ex:
+            if not _may_serve_stale(ex):
+                raise
+            # The shared cache may do blocking I/O.
+            stale = await sync_to_async(
+                _get_stale_authorizations, thread_sensitive=False,
+            )([uuid_string], cache)
+            if not stale:
+                raise
+            return stale[uuid_string]
+        if cache is not None:
+            if cache.alias:
+                await sync_to_async(
+                    cache.set, thread_sensitive=False,
+                )(uuid_string, authorization)
+            else:
+                cache.set(uuid_string, authorization)
+        return authorization
+
+    @staticmethod
+    async def _afetch_authorization(uuid_string: str) -> dict:
+        """Get the user's authorization data from the PERMISSION_ENDPOINT
+
+        Args:
+            uuid_string: The uuid of the user.
+
+        Returns:
+            The authorization data.
+        """
+        config = get_config()
+        with metrics.timer('permission_fetch_seconds'):
+            response = await get_async_client().get(
+                config.permission_endpoint,
+                params={'uuid': uuid_string},
+                headers=config.service_headers,
+                timeout=config.permission_timeout,
+            )
+        response.raise_for_status()
+        return response.json()
+
+
 class ServiceTokenAuthentication(BaseAuthentication):
     """Authenticate requests with Service Token."""
 
@@ -135,7 +698,7 @@ class ServiceTokenAuthentication(BaseAuthentication):
             The `user` and `auth` for the request. Or None if JWT was not used.
         """
         token = self._get_token(request)
-        service_token = settings.JWT_AUTH['SERVICE_SECRET_TOKEN']
+        service_token = get_config().service_secret_token
 
         if not token or not service_token:
             return None
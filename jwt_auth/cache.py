@@ -0,0 +1,293 @@
+"""Caches used on the authentication path."""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import (
+    Any, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple,
+)
+
+from django.core.cache import caches
+
+from jwt_auth import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """A thread safe least recently used cache with per-entry expiry.
+
+    Entries are evicted in least recently used order once the cache holds
+    more than `max_entries` entries or more than `max_bytes` accounted bytes.
+    A limit of 0 means unbounded. Expired entries are kept for `stale_ttl`
+    more seconds, during which only `get_stale` returns them.
+    """
+
+    def __init__(self, max_entries: int = 0, max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_ttl = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Maps keys to (value, not_before, expires_at, size) tuples.
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """The number of bytes accounted for the cached entries."""
+        return self._size
+
+    def get(self, key: Hashable, now: Optional[float] = None) -> Any:
+        """Get a cached value.
+
+        Args:
+            key: The key of the value.
+            now: The current timestamp, defaults to `time.time()`.
+
+        Returns:
+            The value, or None if it is not cached or not valid at `now`.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, not_before, expires_at, size = entry
+            if now >= expires_at:
+                if now >= expires_at + self.stale_ttl:
+                    del self._entries[key]
+                    self._size -= size
+                self.misses += 1
+                return None
+            if now < not_before:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key: Hashable, now: Optional[float] = None) -> Any:
+        """Get a cached value, even if it expired less than `stale_ttl`
+        seconds ago.
+
+        Args:
+            key: The key of the value.
+            now: The current timestamp, defaults to `time.time()`.
+
+        Returns:
+            The value, or None if it is not cached or expired for longer.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now >= entry[2] + self.stale_ttl:
+                return None
+            return entry[0]
+
+    def set(
+            self,
+            key: Hashable,
+            value: Any,
+            expires_at: float,
+            not_before: float = float('-inf'),
+            size: int = 1,
+    ) -> None:
+        """Cache a value.
+
+        Args:
+            key: The key of the value.
+            value: The value to cache.
+            expires_at: The timestamp from which the value is no longer valid.
+            not_before: The timestamp before which the value is not valid.
+            size: The number of bytes accounted for the entry.
+        """
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[3]
+            self._entries[key] = (value, not_before, expires_at, size)
+            self._size += size
+            self._evict()
+
+    def delete(self, key: Hashable) -> None:
+        """Remove a value from the cache."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry[3]
+
+    def clear(self) -> None:
+        """Remove all values and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _evict(self) -> None:
+        while self._entries and (
+                (self.max_entries and len(self._entries) > self.max_entries)
+                or (self.max_bytes and self._size > self.max_bytes)
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry[3]
+
+
+class AuthorizationCache:
+    """Caches users' authorization data keyed by uuid.
+
+    The data is cached in process and, when `alias` is set, in the Django
+    cache with that alias so it is shared between processes. Values are
+    serialized once, as compact JSON, when they are written to the shared
+    cache. Expired data is kept for `stale_ttl` more seconds, to be served
+    by `get_stale_many` while the PERMISSION_ENDPOINT is failing.
+    """
+
+    KEY_PREFIX = 'jwt_auth:authorization:'
+
+    def __init__(self):
+        self.ttl = 0
+        self.stale_ttl = 0
+        self.alias: Optional[str] = None
+        self.local_enabled = True
+        self.local = LRUCache()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, uuid: str) -> Optional[dict]:
+        """Get a user's cached authorization data.
+
+        Args:
+            uuid: The uuid of the user.
+
+        Returns:
+            The authorization data, or None if it is not cached.
+        """
+        return self.get_many([uuid]).get(uuid)
+
+    def get_many(self, uuids: Iterable[str]) -> Dict[str, dict]:
+        """Get the cached authorization data of several users.
+
+        Args:
+            uuids: The uuids of the users.
+
+        Returns:
+            The authorization data of the users that are cached, by uuid.
+        """
+        uuids = set(uuids)
+        found = {}
+        missing = []
+        for uuid in uuids:
+            value = self.local.get(uuid) if self.local_enabled else None
+            if value is None:
+                missing.append(uuid)
+            else:
+                found[uuid] = value
+
+        if missing and self.alias:
+            now = time.time()
+            for uuid, (expires_at, value) in self._get_shared(missing):
+                if now < expires_at:
+                    found[uuid] = value
+                    if self.local_enabled:
+                        self.local.set(uuid, value, expires_at=expires_at)
+
+        self.hits += len(found)
+        self.misses += len(uuids) - len(found)
+        metrics.increment('authorization_cache_hits_total', len(found))
+        metrics.increment(
+            'authorization_cache_misses_total', len(uuids) - len(found),
+        )
+        return found
+
+    def get_stale_many(self, uuids: Iterable[str]) -> Dict[str, dict]:
+        """Get the cached authorization data of several users, even if it
+        expired less than `stale_ttl` seconds ago.
+
+        Args:
+            uuids: The uuids of the users.
+
+        Returns:
+            The authorization data of the users that are cached, by uuid.
+        """
+        found = {}
+        missing = []
+        for uuid in set(uuids):
+            value = (
+                self.local.get_stale(uuid) if self.local_enabled else None
+            )
+            if value is None:
+                missing.append(uuid)
+            else:
+                found[uuid] = value
+
+        if missing and self.alias:
+            now = time.time()
+            for uuid, (expires_at, value) in self._get_shared(missing):
+                if now < expires_at + self.stale_ttl:
+                    found[uuid] = value
+        return found
+
+    def set(self, uuid: str, value: dict) -> None:
+        """Cache a user's authorization data.
+
+        Args:
+            uuid: The uuid of the user.
+            value: The authorization data.
+        """
+        self.set_many({uuid: value})
+
+    def set_many(self, values: Dict[str, dict]) -> None:
+        """Cache the authorization data of several users.
+
+        Args:
+            values: The authorization data by uuid.
+        """
+        expires_at = time.time() + self.ttl
+        if self.local_enabled:
+            for uuid, value in values.items():
+                self.local.set(uuid, value, expires_at=expires_at)
+
+        if self.alias:
+            self._set_shared({
+                self.KEY_PREFIX + uuid: json.dumps(
+                    [expires_at, value], separators=(',', ':'),
+                )
+                for uuid, value in values.items()
+            })
+
+    def clear(self) -> None:
+        """Clear the in-process cache and reset the counters."""
+        self.local.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_shared(self, uuids: List[str]) -> Iterator[Tuple[str, list]]:
+        keys = {self.KEY_PREFIX + uuid: uuid for uuid in uuids}
+        try:
+            values = caches[self.alias].get_many(keys)
+        except Exception:
+            logger.exception('Failed to read the authorization cache.')
+            return
+        for key, raw in values.items():
+            yield keys[key], json.loads(raw)
+
+    def _set_shared(self, values: Dict[str, str]) -> None:
+        try:
+            caches[self.alias].set_many(
+                values, timeout=self.ttl + self.stale_ttl,
+            )
+        except Exception:
+            logger.exception('Failed to write the authorization cache.')
@@ -0,0 +1,149 @@
+"""Stops calling a failing endpoint until it is likely to have recovered."""
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from jwt_auth import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint that is known to be down."""
+
+
+class CircuitBreaker:
+    """Fails fast while an endpoint is down.
+
+    The circuit opens after `failure_threshold` consecutive failures, a
+    threshold of 0 disabling it. While it is open, calls raise
+    `CircuitOpenError` without calling the endpoint. After `reset_timeout`
+    seconds a single trial call is let through: the circuit closes if it
+    succeeds and opens again if it fails.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            is_failure: Callable[[Exception], bool] = lambda ex: True,
+    ):
+        """Initialize.
+
+        Args:
+            name: The name of the circuit, used in the metrics.
+            is_failure: Tells whether an error raised by a call means the
+                endpoint is down, rather than e.g. a bad request.
+        """
+        self.name = name
+        self.is_failure = is_failure
+        self.failure_threshold = 0
+        self.reset_timeout = 30.0
+
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """The state of the circuit: closed, open or half-open."""
+        opened_at = self.opened_at
+        if opened_at is None:
+            return CLOSED
+        if self._trial or time.monotonic() - opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def call(self, function: Callable[[], Any]) -> Any:
+        """Call `function` unless the circuit is open.
+
+        Args:
+            function: Calls the endpoint.
+
+        Returns:
+            The result of the call.
+        """
+        trial = self._before_call()
+        try:
+            result = function()
+        except Exception as ex:
+            self._after_call(ex, trial)
+            raise
+        except BaseException:
+            self._abandon_call(trial)
+            raise
+        self._after_call(None, trial)
+        return result
+
+    async def acall(self, function: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `function()` unless the circuit is open.
+
+        Args:
+            function: The coroutine function calling the endpoint.
+
+        Returns:
+            The result of the call.
+        """
+        trial = self._before_call()
+        try:
+            result = await function()
+        except Exception as ex:
+            self._after_call(ex, trial)
+            raise
+        except BaseException:
+            # E.g. the caller was cancelled.
+            self._abandon_call(trial)
+            raise
+        self._after_call(None, trial)
+        return result
+
+    def reset(self) -> None:
+        """Close the circuit."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def _before_call(self) -> bool:
+        """Check that a call may be made, and whether it is a trial."""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            elapsed = time.monotonic() - self.opened_at
+            if not self._trial and elapsed >= self.reset_timeout:
+                self._trial = True
+                return True
+        metrics.increment('%s_circuit_rejected_total' % self.name)
+        raise CircuitOpenError('The %s circuit is open.' % self.name)
+
+    def _abandon_call(self, trial: bool) -> None:
+        """Forget a call interrupted before the endpoint answered, letting
+        another trial through if it was one."""
+        if trial:
+            with self._lock:
+                self._trial = False
+
+    def _after_call(self, error: Optional[Exception], trial: bool) -> None:
+        failed = error is not None and self.is_failure(error)
+        with self._lock:
+            if trial:
+                self._trial = False
+            if not failed:
+                self.failures = 0
+                self.opened_at = None
+                return
+
+            self.failures += 1
+            if trial or (
+                    self.failure_threshold
+                    and self.failures >= self.failure_threshold
+                    and self.opened_at is None
+            ):
+                self.opened_at = time.monotonic()
+                opened = True
+            else:
+                opened = False
+        if opened:
+            metrics.increment('%s_circuit_opened_total' % self.name)
@@ -0,0 +1,209 @@
+"""Helpers to share work between concurrent threads and coroutines."""
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import (
+    Any, Awaitable, Callable, Dict, Hashable, List, Mapping, Optional, Tuple,
+)
+
+
+class _Call:
+    """A call in flight, awaited by one or more threads."""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls made with the same key.
+
+    While a call for a key is in flight, other threads calling `do` with the
+    same key wait for it and share its result. Errors are raised in every
+    waiting thread and nothing is remembered once the call completes.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """Call `function` unless a call for `key` is already in flight.
+
+        Args:
+            key: Identifies calls that can be shared.
+            function: The function to call.
+
+        Returns:
+            The result of the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+class AsyncSingleFlight:
+    """Deduplicates concurrent coroutine calls made with the same key.
+
+    The asynchronous counterpart of `SingleFlight`: while a call for a key is
+    in flight in an event loop, other coroutines of that loop calling `do`
+    with the same key await it and share its result. The call runs in its
+    own task, so cancelling one caller does not cancel the others.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Tuple[asyncio.AbstractEventLoop, Hashable],
+                          asyncio.Future] = {}
+
+    async def do(
+            self,
+            key: Hashable,
+            function: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Await `function()` unless a call for `key` is already in flight.
+
+        Args:
+            key: Identifies calls that can be shared.
+            function: The coroutine function to call.
+
+        Returns:
+            The result of the call.
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        task = self._tasks.get(flight_key)
+        if task is None:
+            task = self._tasks[flight_key] = asyncio.ensure_future(
+                function(),
+            )
+            task.add_done_callback(partial(self._done, flight_key))
+        return await asyncio.shield(task)
+
+    def _done(self, flight_key: Tuple, task: asyncio.Future) -> None:
+        if self._tasks.get(flight_key) is task:
+            del self._tasks[flight_key]
+        if not task.cancelled():
+            # Mark the error as retrieved in case every caller was cancelled.
+            task.exception()
+
+
+class MicroBatcher:
+    """Gathers the keys looked up by concurrent callers into batches.
+
+    Keys submitted within `window` seconds of the first pending key are
+    passed to `function` in one call, or as soon as `max_size` keys are
+    pending. `function` returns the results by key, which are fanned out to
+    the futures returned by `submit`. Threads wait on the futures with
+    `result()`, and coroutines with `asyncio.wrap_future`.
+
+    Batches are gathered by a daemon thread and run on a small pool of
+    threads, both started by the first submitted key.
+    """
+
+    def __init__(
+            self,
+            function: Callable[[List[Hashable]], Mapping[Hashable, Any]],
+            window: float = 0.002,
+            max_size: int = 64,
+            max_workers: int = 4,
+    ):
+        self.function = function
+        self.window = window
+        self.max_size = max_size
+        self.max_workers = max_workers
+
+        self._pending: Dict[Hashable, Future] = {}
+        self._first_at = 0.0
+        self._condition = threading.Condition()
+        self._dispatcher: Optional[threading.Thread] = None
+
+    def submit(self, key: Hashable) -> Future:
+        """Add a key to the next batch.
+
+        Args:
+            key: The key to look up.
+
+        Returns:
+            The future result for the key. It fails with a `KeyError` if the
+            key is missing from the results of the batch.
+        """
+        with self._condition:
+            self._start()
+            future = self._pending.get(key)
+            if future is None:
+                if not self._pending:
+                    self._first_at = time.monotonic()
+                future = self._pending[key] = Future()
+                if len(self._pending) == 1 \
+                        or len(self._pending) >= self.max_size:
+                    self._condition.notify()
+            return future
+
+    def _start(self) -> None:
+        # Threads do not survive a fork, so they are started again if needed.
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='jwt-auth-batch',
+            )
+            self._dispatcher = threading.Thread(
+                target=self._run,
+                args=(executor,),
+                name='jwt-auth-batcher',
+                daemon=True,
+            )
+            self._dispatcher.start()
+
+    def _run(self, executor: ThreadPoolExecutor) -> None:
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                while len(self._pending) < self.max_size:
+                    remaining = self._first_at + self.window - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                keys = list(self._pending)[:max(self.max_size, 1)]
+                batch = {key: self._pending.pop(key) for key in keys}
+            executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: Dict[Hashable, Future]) -> None:
+        try:
+            results = self.function(list(batch))
+        except BaseException as ex:
+            for future in batch.values():
+                future.set_exception(ex)
+            return
+
+        for key, future in batch.items():
+            try:
+                future.set_result(results[key])
+            except KeyError as ex:
+                future.set_exception(ex)
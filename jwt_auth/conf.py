@@ -0,0 +1,264 @@
+"""Provides the validated settings of the app.
+
+The `JWT_AUTH` dict in django's settings is read once, validated and turned
+into an immutable `Config` that is cheap to access on every request. It is
+built when the app is ready and rebuilt when the settings change.
+"""
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple, Union
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from jwt.algorithms import HMACAlgorithm
+from jwt.exceptions import InvalidKeyError
+
+# Used to encode the HMAC secrets.
+HMAC = HMACAlgorithm(HMACAlgorithm.SHA256)
+
+# Defaults of the integer settings.
+INTEGER_DEFAULTS: Dict[str, int] = {
+    'JWKS_UNKNOWN_KID_CACHE_SIZE': 1024,
+    'TOKEN_CACHE_SIZE': 0,
+    'TOKEN_CACHE_MAX_BYTES': 0,
+    'AUTHORIZATION_CACHE_SIZE': 1024,
+    'HTTP_POOL_SIZE': 10,
+    'HTTP_RETRIES': 2,
+    'PERMISSION_BULK_SIZE': 100,
+    'PERMISSION_CIRCUIT_FAILURES': 0,
+    'VERIFICATION_PROCESSES': 0,
+    'VERIFICATION_QUEUE_SIZE': 64,
+}
+
+# Supported values of the VERIFICATION_ENGINE setting.
+VERIFICATION_ENGINES = ('inline', 'process')
+
+# Defaults of the settings given in seconds, or other numbers.
+NUMBER_DEFAULTS: Dict[str, float] = {
+    'JWKS_MAX_AGE': 3600,
+    'JWKS_MIN_AGE': 60,
+    'JWKS_REFETCH_INTERVAL': 10,
+    'TOKEN_CACHE_TTL': 300,
+    'AUTHORIZATION_CACHE_TTL': 0,
+    'HTTP_BACKOFF_FACTOR': 0.1,
+    'PERMISSION_TIMEOUT': 5,
+    'JWKS_TIMEOUT': 5,
+    'PERMISSION_BATCH_WINDOW': 0,
+    'AUTHORIZATION_CACHE_STALE_TTL': 0,
+    'PERMISSION_CIRCUIT_RESET': 30,
+    'AUTHORIZATION_CLAIM_MAX_AGE': 300,
+}
+
+
+@dataclass(frozen=True)
+class Config:
+    """The settings of the app, see the README for their description."""
+
+    # The HMAC secrets, encoded to bytes, either as a tuple or keyed by kid.
+    keys: Union[Tuple[bytes, ...], Mapping[str, bytes]] = ()
+    permission_endpoint: str = ''
+    permission_bulk_endpoint: str = ''
+    service_secret_token: str = ''
+    # The headers authenticating requests to other services.
+    service_headers: Mapping[str, str] = field(
+        default_factory=lambda: MappingProxyType({'Token': ''}),
+    )
+    jwks_endpoint: str = ''
+    verify_aud: bool = True
+
+    jwks_max_age: float = NUMBER_DEFAULTS['JWKS_MAX_AGE']
+    jwks_min_age: float = NUMBER_DEFAULTS['JWKS_MIN_AGE']
+    jwks_background_refresh: bool = False
+    jwks_refetch_interval: float = NUMBER_DEFAULTS['JWKS_REFETCH_INTERVAL']
+    jwks_unknown_kid_cache_size: int = \
+        INTEGER_DEFAULTS['JWKS_UNKNOWN_KID_CACHE_SIZE']
+
+    token_cache_size: int = INTEGER_DEFAULTS['TOKEN_CACHE_SIZE']
+    token_cache_max_bytes: int = INTEGER_DEFAULTS['TOKEN_CACHE_MAX_BYTES']
+    token_cache_ttl: float = NUMBER_DEFAULTS['TOKEN_CACHE_TTL']
+
+    authorization_cache_ttl: float = NUMBER_DEFAULTS['AUTHORIZATION_CACHE_TTL']
+    authorization_cache_size: int = \
+        INTEGER_DEFAULTS['AUTHORIZATION_CACHE_SIZE']
+    authorization_cache_alias: Optional[str] = None
+    authorization_cache_stale_ttl: float = \
+        NUMBER_DEFAULTS['AUTHORIZATION_CACHE_STALE_TTL']
+    authorization_claim: str = ''
+    authorization_claim_max_age: float = \
+        NUMBER_DEFAULTS['AUTHORIZATION_CLAIM_MAX_AGE']
+
+    http_pool_size: int = INTEGER_DEFAULTS['HTTP_POOL_SIZE']
+    http_retries: int = INTEGER_DEFAULTS['HTTP_RETRIES']
+    http_backoff_factor: float = NUMBER_DEFAULTS['HTTP_BACKOFF_FACTOR']
+    permission_timeout: float = NUMBER_DEFAULTS['PERMISSION_TIMEOUT']
+    permission_bulk_size: int = INTEGER_DEFAULTS['PERMISSION_BULK_SIZE']
+    permission_batch_window: float = NUMBER_DEFAULTS['PERMISSION_BATCH_WINDOW']
+    permission_circuit_failures: int = \
+        INTEGER_DEFAULTS['PERMISSION_CIRCUIT_FAILURES']
+    permission_circuit_reset: float = \
+        NUMBER_DEFAULTS['PERMISSION_CIRCUIT_RESET']
+    jwks_timeout: float = NUMBER_DEFAULTS['JWKS_TIMEOUT']
+
+    verification_engine: str = 'inline'
+    metrics_collector: str = ''
+    verification_processes: int = INTEGER_DEFAULTS['VERIFICATION_PROCESSES']
+    verification_queue_size: int = \
+        INTEGER_DEFAULTS['VERIFICATION_QUEUE_SIZE']
+
+
+_config: Optional[Config] = None
+
+
+def get_config() -> Config:
+    """Get the current settings of the app.
+
+    Returns:
+        The settings, built from `settings.JWT_AUTH` if not built yet.
+    """
+    config = _config
+    if config is None:
+        config = load_config()
+    return config
+
+
+def load_config() -> Config:
+    """Build the settings of the app from `settings.JWT_AUTH`.
+
+    Returns:
+        The settings.
+
+    Raises:
+        ImproperlyConfigured: If a setting is invalid.
+    """
+    global _config
+
+    _config = build_config(getattr(settings, 'JWT_AUTH', {}))
+    return _config
+
+
+def build_config(jwt_auth: dict) -> Config:
+    """Validate the given `JWT_AUTH` settings.
+
+    Args:
+        jwt_auth: The `JWT_AUTH` settings.
+
+    Returns:
+        The settings.
+
+    Raises:
+        ImproperlyConfigured: If a setting is invalid.
+    """
+    if not isinstance(jwt_auth, dict):
+        raise ImproperlyConfigured('JWT_AUTH must be a dict.')
+
+    service_secret_token = _string(jwt_auth, 'SERVICE_SECRET_TOKEN')
+    values: Dict[str, Any] = {
+        name.lower(): _integer(jwt_auth, name, default)
+        for name, default in INTEGER_DEFAULTS.items()
+    }
+    values.update(
+        (name.lower(), _number(jwt_auth, name, default))
+        for name, default in NUMBER_DEFAULTS.items()
+    )
+
+    return Config(
+        keys=_keys(jwt_auth.get('KEYS', [])),
+        permission_endpoint=_string(jwt_auth, 'PERMISSION_ENDPOINT'),
+        permission_bulk_endpoint=_string(
+            jwt_auth, 'PERMISSION_BULK_ENDPOINT',
+        ),
+        service_secret_token=service_secret_token,
+        service_headers=MappingProxyType({'Token': service_secret_token}),
+        jwks_endpoint=_string(jwt_auth, 'JWKS_ENDPOINT'),
+        verify_aud=_boolean(jwt_auth, 'VERIFY_AUD', True),
+        jwks_background_refresh=_boolean(
+            jwt_auth, 'JWKS_BACKGROUND_REFRESH', False,
+        ),
+        authorization_cache_alias=_cache_alias(
+            jwt_auth, 'AUTHORIZATION_CACHE_ALIAS',
+        ),
+        verification_engine=_choice(
+            jwt_auth, 'VERIFICATION_ENGINE', VERIFICATION_ENGINES,
+        ),
+        metrics_collector=_string(jwt_auth, 'METRICS_COLLECTOR'),
+        authorization_claim=_string(jwt_auth, 'AUTHORIZATION_CLAIM'),
+        **values
+    )
+
+
+@receiver(setting_changed)
+def _reload_config(setting: str, **kwargs) -> None:
+    if setting == 'JWT_AUTH':
+        load_config()
+
+
+def _keys(keys: Any) -> Union[Tuple[bytes, ...], Mapping[str, bytes]]:
+    if isinstance(keys, dict):
+        return MappingProxyType({
+            str(kid): _key(key) for kid, key in keys.items()
+        })
+    if isinstance(keys, (list, tuple)):
+        return tuple(_key(key) for key in keys)
+    raise ImproperlyConfigured('JWT_AUTH KEYS must be a list or a dict.')
+
+
+def _key(key: Any) -> bytes:
+    if not key or not isinstance(key, (str, bytes)):
+        raise ImproperlyConfigured('JWT_AUTH KEYS must be non-empty strings.')
+    try:
+        return HMAC.prepare_key(key)
+    except InvalidKeyError as ex:
+        raise ImproperlyConfigured('Invalid JWT_AUTH key: %s' % ex)
+
+
+def _string(jwt_auth: dict, name: str) -> str:
+    value = jwt_auth.get(name) or ''
+    if not isinstance(value, str):
+        raise ImproperlyConfigured('JWT_AUTH %s must be a string.' % name)
+    return value
+
+
+def _boolean(jwt_auth: dict, name: str, default: bool) -> bool:
+    value = jwt_auth.get(name, default)
+    if not isinstance(value, bool):
+        raise ImproperlyConfigured('JWT_AUTH %s must be a boolean.' % name)
+    return value
+
+
+def _integer(jwt_auth: dict, name: str, default: int) -> int:
+    value = jwt_auth.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ImproperlyConfigured(
+            'JWT_AUTH %s must be a non-negative integer.' % name
+        )
+    return value
+
+
+def _number(jwt_auth: dict, name: str, default: float) -> float:
+    value = jwt_auth.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) \
+            or value < 0:
+        raise ImproperlyConfigured(
+            'JWT_AUTH %s must be a non-negative number.' % name
+        )
+    return value
+
+
+def _choice(jwt_auth: dict, name: str, choices: Tuple[str, ...]) -> str:
+    value = jwt_auth.get(name, choices[0])
+    if value not in choices:
+        raise ImproperlyConfigured(
+            'JWT_AUTH %s must be one of %s.' % (name, ', '.join(choices))
+        )
+    return value
+
+
+def _cache_alias(jwt_auth: dict, name: str) -> Optional[str]:
+    alias = jwt_auth.get(name)
+    if alias is not None and alias not in settings.CACHES:
+        raise ImproperlyConfigured(
+            'JWT_AUTH %s must be one of the CACHES.' % name
+        )
+    return alias
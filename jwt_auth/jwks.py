@@ -1,15 +1,27 @@
 """Utilities related to JWT."""
 import json
 import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 
 import requests
-from django.conf import settings
 from django.core.exceptions import SuspiciousOperation
 from django.utils.encoding import force_str
+from django.utils.http import parse_http_date_safe
 from jwt.algorithms import RSAAlgorithm
 from rest_framework import status
 
-logger = logging.getLogger()
+from jwt_auth import metrics
+from jwt_auth.conf import get_config
+from jwt_auth.session import get_session
+
+logger = logging.getLogger(__name__)
+
+# Fraction of the remaining lifetime after which the background refresher
+# fetches the key set again.
+REFRESH_AHEAD = 0.9
 
 
 class Jwks:
@@ -18,39 +30,278 @@ class Jwks:
     def __init__(self):
         """Initialize."""
         self._jwks = None
+        # Public keys indexed by kid, stored as (alg, key) pairs. The dict is
+        # only ever replaced as a whole, never mutated, so readers always see
+        # a complete key set.
+        self._keys: Optional[Dict[str, Tuple[Optional[str], object]]] = None
+        self._etag: Optional[str] = None
+        # Incremented whenever new keys are loaded.
+        self.generation = 0
+        self._expires_at = 0.0
+        self._fetched_at = float('-inf')
+        # Kids that were missing from the key set, mapped to the time they
+        # were looked up, so they do not trigger a refetch on every request.
+        self._unknown_kids: OrderedDict = OrderedDict()
+        self._unknown_kids_lock = threading.Lock()
+        # Held while a fetch is in flight, so concurrent cache misses and
+        # refreshes result in a single request to the endpoint.
+        self._refresh_lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def key_set(self) -> Optional[dict]:
+        """The key set last loaded from the endpoint, or None."""
+        return self._jwks
 
     def get_jwk(self, header: dict):
         """Get JWK matching the kid in the token."""
-        # Cache the key set once retrieved.
-        if not self._jwks:
-            self._jwks = self._get_jwks()
+        # Cache the key set once retrieved. An expired key set keeps being
+        # served while it is revalidated in the background.
+        if self._keys is None:
+            self._load_once()
+        elif time.monotonic() >= self._expires_at:
+            self._revalidate()
 
         key = self._find_jwk(header)
-        if key:
-            return RSAAlgorithm.from_jwk(json.dumps(key))
+        if key is None:
+            key = self._refetch(header)
+        return key
+
+    def start(self) -> None:
+        """Start refreshing the key set in a background thread.
+
+        The key set is fetched right away and then refreshed shortly before
+        it expires, so requests never wait for the JWKS endpoint.
+        """
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._stopped.clear()
+        self._refresher = threading.Thread(
+            target=self._run_refresher,
+            name='jwks-refresher',
+            daemon=True,
+        )
+        self._refresher.start()
+
+    def stop(self) -> None:
+        """Stop the background refresher."""
+        self._stopped.set()
+        if self._refresher is not None:
+            self._refresher.join()
+            self._refresher = None
+
+    def refresh(self) -> None:
+        """Fetch the key set from the JWKS endpoint.
+
+        A conditional request is made when a key set is already cached, so
+        an unchanged key set only costs a `304 Not Modified` response.
+        """
+        etag = self._etag if self._keys is not None else None
+        self._fetched_at = time.monotonic()
+        metrics.increment('jwks_refreshes_total')
+        with metrics.timer('jwks_fetch_seconds'):
+            response = self._get_jwks(etag)
+        if response is None:
+            self._load({})
+            self._etag = None
+            self._expires_at = time.monotonic() + self._lifetime({})
+            return
+
+        if response.status_code == status.HTTP_304_NOT_MODIFIED \
+                and self._keys is not None:
+            logger.debug('JWKS not modified.')
+        else:
+            if response.status_code != status.HTTP_200_OK:
+                logger.error('Failed load JWKS.')
+            response.raise_for_status()
+            self._load(response.json())
+            self._etag = response.headers.get('ETag')
+
+        self._expires_at = time.monotonic() + self._lifetime(response.headers)
+
+    def _load_once(self) -> None:
+        """Fetch the key set, waiting for a fetch that is already in flight.
+        """
+        with self._refresh_lock:
+            if self._keys is None:
+                self.refresh()
+
+    def _refetch(self, header: dict):
+        """Refetch the key set for a kid that is not in the cached key set.
+
+        Refetches happen at most once every `JWKS_REFETCH_INTERVAL` seconds
+        and unknown kids are remembered for as long, so the load on the JWKS
+        endpoint stays bounded whatever kids clients send.
+
+        Args:
+            header: The unverified header of the token.
+
+        Returns:
+            The public key, or None if the kid is still unknown.
+        """
+        kid = force_str(header['kid'])
+        interval = get_config().jwks_refetch_interval
+        looked_up_at = self._unknown_kids.get(kid)
+        if looked_up_at is not None \
+                and time.monotonic() - looked_up_at < interval:
+            return None
+
+        with self._refresh_lock:
+            # The key set may have been refreshed while waiting.
+            key = self._find_jwk(header)
+            if key is None and time.monotonic() - self._fetched_at >= interval:
+                logger.debug('Unknown kid, refetch JWKS.')
+                self._try_refresh()
+                key = self._find_jwk(header)
+
+        if key is None:
+            self._add_unknown_kid(kid)
+        return key
+
+    def _add_unknown_kid(self, kid: str) -> None:
+        max_size = get_config().jwks_unknown_kid_cache_size
+        with self._unknown_kids_lock:
+            self._unknown_kids[kid] = time.monotonic()
+            self._unknown_kids.move_to_end(kid)
+            while len(self._unknown_kids) > max_size:
+                self._unknown_kids.popitem(last=False)
+
+    def _revalidate(self) -> None:
+        """Refresh the expired key set in a background thread."""
+        if not self._refresh_lock.acquire(blocking=False):
+            # A refresh is already in flight.
+            return
+        thread = threading.Thread(
+            target=self._background_refresh,
+            name='jwks-revalidate',
+            daemon=True,
+        )
+        thread.start()
+
+    def _background_refresh(self) -> None:
+        try:
+            self._try_refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def _run_refresher(self) -> None:
+        while not self._stopped.is_set():
+            with self._refresh_lock:
+                self._try_refresh()
+
+            # Refresh ahead of expiry so the key set never goes stale.
+            remaining = self._expires_at - time.monotonic()
+            self._stopped.wait(max(remaining * REFRESH_AHEAD, 1))
+
+    def _try_refresh(self) -> None:
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('Failed to refresh JWKS.')
+            metrics.increment('jwks_refresh_errors_total')
+            # Keep serving the cached keys and retry soon, so a transient
+            # error does not hold up key rotation for `JWKS_MAX_AGE`.
+            self._expires_at = time.monotonic() + get_config().jwks_min_age
 
     def _find_jwk(self, header):
-        key = None
-        for jwk in self._jwks.get('keys', []):
-            if jwk['kid'] == force_str(header['kid']):
-                if 'alg' in jwk and jwk['alg'] != force_str(header['alg']):
-                    raise SuspiciousOperation('alg values do not match.')
-
-                key = jwk
-                break
+        entry = self._keys.get(force_str(header['kid']))
+        if entry is None:
+            return None
+
+        alg, key = entry
+        if alg is not None and alg != force_str(header['alg']):
+            raise SuspiciousOperation('alg values do not match.')
         return key
 
+    def _load(self, jwks: dict) -> None:
+        """Build the public keys for the given key set.
+
+        Args:
+            jwks: The JSON Web Key Set as returned by the JWKS endpoint.
+        """
+        keys = {}
+        for jwk in jwks.get('keys', []):
+            kid = jwk.get('kid')
+            if kid is None:
+                continue
+            try:
+                key = RSAAlgorithm.from_jwk(json.dumps(jwk))
+            except Exception:
+                logger.warning('Skipping invalid JWK %s.', kid)
+                continue
+            keys[kid] = (jwk.get('alg'), key)
+
+        self._jwks = jwks
+        self._keys = keys
+        self.generation += 1
+        # Previously unknown kids may be in the new key set.
+        self._unknown_kids = OrderedDict()
+
+    @staticmethod
+    def _lifetime(headers) -> float:
+        """Get the number of seconds a key set may be cached.
+
+        The lifetime advertised by the endpoint is used when present and
+        bounded by `JWKS_MIN_AGE` and `JWKS_MAX_AGE`.
+
+        Args:
+            headers: The headers of the JWKS response.
+
+        Returns:
+            The lifetime of the key set in seconds.
+        """
+        config = get_config()
+
+        lifetime = _header_lifetime(headers)
+        if lifetime is None:
+            lifetime = config.jwks_max_age
+        return min(max(lifetime, config.jwks_min_age), config.jwks_max_age)
+
     @staticmethod
-    def _get_jwks() -> dict:
+    def _get_jwks(etag: Optional[str] = None) -> Optional[requests.Response]:
         logger.debug('Load JWKS.')
-        jwks_endpoint = settings.JWT_AUTH.get('JWKS_ENDPOINT')
-        if not jwks_endpoint:
+        config = get_config()
+        if not config.jwks_endpoint:
             logger.debug('JWKS_ENDPOINT not configured.')
-            return {}
+            return None
+
+        headers = {'If-None-Match': etag} if etag else None
+        return get_session().get(
+            config.jwks_endpoint,
+            headers=headers,
+            timeout=config.jwks_timeout,
+        )
+
+
+def _header_lifetime(headers) -> Optional[float]:
+    """Get the freshness lifetime from `Cache-Control` or `Expires` headers.
+
+    Args:
+        headers: The response headers.
+
+    Returns:
+        The lifetime in seconds, or None if the headers do not specify one.
+    """
+    cache_control = headers.get('Cache-Control')
+    if cache_control:
+        for directive in cache_control.split(','):
+            name, _, value = directive.strip().partition('=')
+            name = name.lower()
+            if name in ('no-cache', 'no-store'):
+                return 0
+            if name == 'max-age':
+                try:
+                    max_age = int(value.strip('"'))
+                    age = int(headers.get('Age', 0))
+                except ValueError:
+                    return 0
+                return max(max_age - age, 0)
 
-        response = requests.get(jwks_endpoint)
-        if response.status_code != status.HTTP_200_OK:
-            logger.error('Failed load JWKS.')
-        response.raise_for_status()
+    expires = headers.get('Expires')
+    if expires:
+        # An invalid date means the response is already expired.
+        expires_at = parse_http_date_safe(expires) or 0
+        return max(expires_at - time.time(), 0)
 
-        return response.json()
+    return None
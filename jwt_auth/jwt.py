@@ -1,87 +1,516 @@
+import binascii
+import hashlib
+import json
 import logging
-from django.conf import settings
-from typing import Optional, List
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.encoding import force_bytes, force_str
+from typing import (
+    Dict, Mapping, NamedTuple, Optional, List, Sequence, Tuple, Union,
+)
 
 import jwt
+from jwt.algorithms import get_default_algorithms
+from jwt.utils import base64url_decode
+from jwt_auth.cache import LRUCache
+from jwt_auth.conf import get_config
+from jwt_auth import metrics
 from jwt_auth.jwks import Jwks
+from jwt_auth.verification import ProcessVerifier
 
 
-logger = logging.getLogger()
+logger = logging.getLogger(__name__)
 
 
-# Load JSON Web Key Set globally, to cache the keys. Any service that
-# uses this library should restart to reset the key set.
+# Algorithms used to check signatures, by name.
+ALGORITHMS = get_default_algorithms()
+
+# Load JSON Web Key Set globally, to cache the keys. The key set is
+# revalidated once it expires, see `JWKS_MAX_AGE`.
 JWKS = Jwks()
 
+# Verifies RS256 signatures in other processes, see `VERIFICATION_ENGINE`.
+PROCESS_VERIFIER = ProcessVerifier()
+
+# Verified payloads keyed by the digest of the token and of the keys it was
+# verified with, see `TOKEN_CACHE_SIZE`.
+TOKEN_CACHE = LRUCache()
+
+# Approximate memory used by a token cache entry besides the payload, which
+# is accounted for by the length of the token.
+TOKEN_CACHE_ENTRY_OVERHEAD = 256
+
+# The secrets tokens may be signed with, either as a sequence or keyed by kid.
+Keys = Union[Sequence[Union[str, bytes]], Mapping[str, Union[str, bytes]]]
+
+# Verifies the RS256 tokens of `verify_many` in parallel, as the
+# `cryptography` backend releases the GIL while checking signatures.
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+
+
+class ParsedToken(NamedTuple):
+    """The parts of a token, decoded once."""
+
+    header: dict
+    payload: bytes
+    signing_input: bytes
+    signature: bytes
+
+
+def _get_token_cache() -> Optional[LRUCache]:
+    """Get the verified token cache, if it is enabled in the settings."""
+    config = get_config()
+    if not config.token_cache_size:
+        return None
+    TOKEN_CACHE.max_entries = config.token_cache_size
+    TOKEN_CACHE.max_bytes = config.token_cache_max_bytes
+    return TOKEN_CACHE
+
+
+def _get_verifier() -> Optional[ProcessVerifier]:
+    """Get the process verifier, if it is enabled in the settings."""
+    config = get_config()
+    if config.verification_engine != 'process':
+        return None
+    PROCESS_VERIFIER.processes = config.verification_processes
+    PROCESS_VERIFIER.queue_size = config.verification_queue_size
+    return PROCESS_VERIFIER
+
+
+@receiver(setting_changed)
+def _clear_token_cache(setting: str, **kwargs) -> None:
+    # Cached payloads were verified with the previous keys and options.
+    if setting == 'JWT_AUTH':
+        TOKEN_CACHE.clear()
+        PROCESS_VERIFIER.shutdown()
+
 
 class JWT:
     """Represents a JWT."""
 
-    def __init__(self, token: str, keys: List[str]):
+    def __init__(
+            self,
+            token: Union[str, bytes],
+            keys: Keys,
+    ):
+        """Initialize.
+
+        Args:
+            token: The encoded token.
+            keys: The secrets the token may be signed with, either as a list
+                or as a dict keyed by the kid of each secret.
+        """
         self._token = token
         self._keys = keys
 
+        self._parsed: Optional[ParsedToken] = None
         self._payload: Optional[dict] = None
 
     @property
     def payload(self) -> dict:
-        """The payload stored in the jwt."""
+        """The payload stored in the jwt.
+
+        The payload may be shared with other instances through the token
+        cache, so it must not be modified.
+        """
         if self._payload is None:
-            # If RS256 header is detected, try to decode the token using
-            # JWKS if endpoint is configured.
-            keys = self._keys
-            unverified_header = jwt.get_unverified_header(self._token)
-            alg = unverified_header.get('alg')
+            cache = _get_token_cache()
+            if cache is None:
+                self._payload = self._verify()
+                return self._payload
+
+            digest = self._cache_key()
+            payload = cache.get(digest)
+            if payload is None:
+                metrics.increment('token_cache_misses_total')
+                payload = self._verify()
+                self._cache_payload(cache, digest, payload)
+            else:
+                metrics.increment('token_cache_hits_total')
+            self._payload = payload
+
+        return self._payload
+
+    def _cache_key(self) -> bytes:
+        """Get the digest of the token and of the keys it is verified with.
+
+        A payload verified with some keys is thus never returned to a caller
+        passing other keys, nor once the key set has changed.
+
+        Returns:
+            The key of the token in the token cache.
+        """
+        digest = hashlib.sha256()
+        if isinstance(self._keys, Mapping):
+            keys = sorted(self._keys.items())
+        else:
+            keys = [('', key) for key in self._keys]
+        for kid, key in keys:
+            for part in (force_bytes(kid), force_bytes(key)):
+                digest.update(b'%d:' % len(part))
+                digest.update(part)
+        digest.update(b'%d:' % JWKS.generation)
+        digest.update(force_bytes(self._token))
+        return digest.digest()
+
+    def _cache_payload(
+            self,
+            cache: LRUCache,
+            digest: bytes,
+            payload: dict,
+    ) -> None:
+        """Cache the verified payload until the token expires.
+
+        Args:
+            cache: The token cache.
+            digest: The cache key of the token.
+            payload: The verified payload.
+        """
+        expires_at = time.time() + get_config().token_cache_ttl
+        exp = payload.get('exp')
+        if exp is not None:
+            expires_at = min(expires_at, int(exp))
+        not_before = payload.get('nbf')
+
+        cache.set(
+            digest,
+            payload,
+            expires_at=expires_at,
+            not_before=(
+                int(not_before) if not_before is not None else float('-inf')
+            ),
+            size=TOKEN_CACHE_ENTRY_OVERHEAD + len(self._token),
+        )
+
+    def _verify(self) -> dict:
+        """Verify the token and get its payload.
+
+        The token is parsed once and the key lookup, signature check and
+        claim validation all work on the parsed token.
+
+        Returns:
+            The payload of the token.
+        """
+        token = self._parsed
+        if token is None:
+            with metrics.timer('token_parse_seconds'):
+                token = parse(self._token)
+
+        # If RS256 header is detected, try to decode the token using
+        # JWKS if endpoint is configured.
+        with metrics.timer('key_lookup_seconds'):
+            keys = self._candidate_keys(token.header)
+            alg = token.header.get('alg')
+            key = None
             if alg == 'RS256':
                 logger.debug('RS256 algorithm.')
-                key = JWKS.get_jwk(unverified_header)
+                key = JWKS.get_jwk(token.header)
                 if key:
                     # Use the fetched key because key is retrieved using
                     # kid in the header, and therefore it should be valid.
                     keys = [key]
                     logger.debug('Use JWS RS256 Key.')
 
-            if not keys:
-                logger.debug('Keys not found.')
-                raise ValueError('JWT_AUTH keys are not configured properly.')
+        if not keys:
+            logger.debug('Keys not found.')
+            raise ValueError('JWT_AUTH keys are not configured properly.')
 
-            self._payload = self._decode(keys=keys, alg=alg)
+        with metrics.timer('signature_verification_seconds'):
+            if not (key and self._check_signature_offloaded(token)):
+                self._check_signature(token, keys, alg)
 
-        return self._payload
+        logger.debug('Decode payload.')
+        payload = decode_payload(token)
+        validate_claims(
+            payload,
+            verify_audience=get_config().verify_aud,
+        )
+        logger.debug('Payload decoded.')
 
-    def _decode(
-            self,
-            keys: list,
-            alg: str = 'HS256',
-    ) -> dict:
+        return payload
+
+    def _candidate_keys(self, header: dict) -> Sequence:
+        """Get the keys the token may be signed with.
+
+        When the keys are named and the token has a kid, only the key with
+        that name is a candidate.
+
+        Args:
+            header: The unverified header of the token.
+
+        Returns:
+            The candidate keys.
         """
-        Decode the JWT and JWS.
+        if not isinstance(self._keys, Mapping):
+            return self._keys
+
+        kid = header.get('kid')
+        if kid is None:
+            return list(self._keys.values())
+        key = self._keys.get(kid)
+        return [key] if key else []
+
+    @staticmethod
+    def _check_signature_offloaded(token: ParsedToken) -> bool:
+        """Check the RS256 signature of the token in the process pool.
+
+        Args:
+            token: The parsed token, signed with a key of the key set.
 
         Returns:
-            A dictionary containing the payload
+            `True` if the signature is valid, `False` if it was not checked.
         """
-        logger.debug('Decode payload.')
-        verify_audience = settings.JWT_AUTH.get('VERIFY_AUD', True)
+        verifier = _get_verifier()
+        if verifier is None:
+            return False
+
+        verified = verifier.verify(
+            JWKS.key_set,
+            force_str(token.header['kid']),
+            token.signing_input,
+            token.signature,
+        )
+        if verified is None:
+            return False
+        if not verified:
+            raise jwt.InvalidSignatureError()
+        return True
+
+    @staticmethod
+    def _check_signature(
+            token: ParsedToken,
+            keys: Sequence,
+            alg: Optional[str],
+    ) -> None:
+        """Check that the token is signed with one of the keys.
+
+        Args:
+            token: The parsed token.
+            keys: The candidate keys.
+            alg: The algorithm of the token, if its header has one.
+        """
+        algorithm = ALGORITHMS.get(alg)
+        if algorithm is None or alg == 'none':
+            raise jwt.InvalidAlgorithmError(
+                'The specified alg value is not allowed'
+            )
+
         for key in keys:
-            try:
-                logger.debug('Payload decoding.')
-                payload = jwt.decode(
-                    self._token,
-                    key,
-                    algorithms=[alg],
-                    options={
-                        'verify_signature': True,
-                        'verify_aud': verify_audience,
-                    }
-                )
-                logger.debug('Payload decoded.')
-
-                return payload
-            # If an InvalidSignatureError was raised try another key
-            except jwt.InvalidSignatureError:
-                continue
+            if algorithm.verify(
+                    token.signing_input,
+                    algorithm.prepare_key(key),
+                    token.signature,
+            ):
+                return
 
         logger.debug('Failed to find a key.')
 
         # If none of the keys work raise InvalidSignatureError
         raise jwt.InvalidSignatureError()
+
+
+def verify_many(
+        tokens: Sequence[Union[str, bytes]],
+        keys: Optional[Keys] = None,
+) -> List[Union[dict, Exception]]:
+    """Verify several tokens and get their payloads.
+
+    Identical tokens are verified once. RS256 tokens are grouped by kid and
+    each group is verified in chunks on a thread pool, while the other
+    tokens are verified in the calling thread.
+
+    Args:
+        tokens: The encoded tokens.
+        keys: The secrets the tokens may be signed with, defaults to the
+            `KEYS` setting.
+
+    Returns:
+        The payload of each token, in order, or the error raised verifying
+        it. The payloads must not be modified.
+    """
+    verification_keys = get_config().keys if keys is None else keys
+
+    # The payload or error of each token, and the parsed tokens grouped by
+    # alg and kid.
+    results: Dict[bytes, Union[dict, Exception]] = {}
+    seen = set()
+    groups: Dict[Tuple[Optional[str], Optional[str]], List[JWT]] = {}
+    for token in map(force_bytes, tokens):
+        if token in seen:
+            continue
+        seen.add(token)
+        jwt_ = JWT(token, verification_keys)
+        try:
+            parsed = jwt_._parsed = parse(token)
+        except Exception as ex:
+            results[token] = ex
+            continue
+        key = (parsed.header.get('alg'), parsed.header.get('kid'))
+        groups.setdefault(key, []).append(jwt_)
+
+    inline: List[JWT] = []
+    chunks: List[List[JWT]] = []
+    workers = os.cpu_count() or 1
+    for (alg, _), group in groups.items():
+        if alg != 'RS256':
+            inline.extend(group)
+            continue
+        size = -(-len(group) // workers)
+        chunks.extend(
+            group[start:start + size] for start in range(0, len(group), size)
+        )
+    if len(chunks) == 1:
+        inline.extend(chunks.pop())
+
+    futures = []
+    if chunks:
+        executor = _get_executor()
+        futures = [executor.submit(_verify_chunk, chunk) for chunk in chunks]
+    results.update(_verify_chunk(inline))
+    for future in futures:
+        results.update(future.result())
+
+    return [results[force_bytes(token)] for token in tokens]
+
+
+def _verify_chunk(
+        jwts: List[JWT],
+) -> List[Tuple[bytes, Union[dict, Exception]]]:
+    """Verify tokens and get each payload or error by token."""
+    results: List[Tuple[bytes, Union[dict, Exception]]] = []
+    for jwt_ in jwts:
+        token = force_bytes(jwt_._token)
+        try:
+            results.append((token, jwt_.payload))
+        except Exception as ex:
+            results.append((token, ex))
+    return results
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Get the thread pool of `verify_many`, made again after a fork."""
+    global _executor, _executor_pid
+
+    pid = os.getpid()
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = ThreadPoolExecutor(
+                thread_name_prefix='jwt-auth-verify',
+            )
+            _executor_pid = pid
+        return _executor
+
+
+def parse(token: Union[str, bytes]) -> ParsedToken:
+    """Split a token and decode its parts.
+
+    Args:
+        token: The encoded token.
+
+    Returns:
+        The parsed token.
+    """
+    try:
+        signing_input, signature = force_bytes(token).rsplit(b'.', 1)
+        header_segment, payload_segment = signing_input.split(b'.', 1)
+    except ValueError:
+        raise jwt.DecodeError('Not enough segments')
+
+    try:
+        header = json.loads(base64url_decode(header_segment))
+    except (TypeError, ValueError, binascii.Error):
+        raise jwt.DecodeError('Invalid header')
+    if not isinstance(header, dict):
+        raise jwt.DecodeError('Invalid header string: must be a json object')
+    for name in ('alg', 'kid'):
+        if not isinstance(header.get(name, ''), str):
+            raise jwt.InvalidTokenError(
+                'The %s header parameter must be a string' % name,
+            )
+
+    try:
+        payload = base64url_decode(payload_segment)
+    except (TypeError, binascii.Error):
+        raise jwt.DecodeError('Invalid payload padding')
+
+    try:
+        signature = base64url_decode(signature)
+    except (TypeError, binascii.Error):
+        raise jwt.DecodeError('Invalid crypto padding')
+
+    return ParsedToken(header, payload, signing_input, signature)
+
+
+def decode_payload(token: ParsedToken) -> dict:
+    """Decode the JSON payload of a parsed token.
+
+    Args:
+        token: The parsed token.
+
+    Returns:
+        The payload.
+    """
+    try:
+        payload = json.loads(token.payload)
+    except ValueError as ex:
+        raise jwt.DecodeError('Invalid payload string: %s' % ex)
+    if not isinstance(payload, dict):
+        raise jwt.DecodeError('Invalid payload string: must be a json object')
+    return payload
+
+
+def validate_claims(
+        payload: dict,
+        verify_audience: bool = True,
+        now: Optional[float] = None,
+) -> None:
+    """Validate the registered claims of a payload.
+
+    The `exp`, `nbf` and `iat` claims are validated the way `jwt.decode`
+    does by default. As no audience is expected, a payload with an `aud`
+    claim is rejected when `verify_audience` is set.
+
+    Args:
+        payload: The payload of the token.
+        verify_audience: Whether to verify the `aud` claim.
+        now: The current timestamp, defaults to `time.time()`.
+    """
+    if now is None:
+        now = time.time()
+
+    if 'iat' in payload:
+        try:
+            int(payload['iat'])
+        except (TypeError, ValueError):
+            raise jwt.InvalidIssuedAtError(
+                'Issued At claim (iat) must be an integer.'
+            )
+
+    if 'nbf' in payload:
+        try:
+            nbf = int(payload['nbf'])
+        except (TypeError, ValueError):
+            raise jwt.DecodeError('Not Before claim (nbf) must be an integer.')
+        if nbf > now:
+            raise jwt.ImmatureSignatureError(
+                'The token is not yet valid (nbf)'
+            )
+
+    if 'exp' in payload:
+        try:
+            exp = int(payload['exp'])
+        except (TypeError, ValueError):
+            raise jwt.DecodeError(
+                'Expiration Time claim (exp) must be an integer.'
+            )
+        if exp < now:
+            raise jwt.ExpiredSignatureError('Signature has expired')
+
+    if verify_audience and 'aud' in payload:
+        raise jwt.InvalidAudienceError('Invalid audience')
@@ -0,0 +1,172 @@
+"""Instrumentation of the authentication path.
+
+The authentication path reports counters and latencies to the current
+collector. The default collector discards them; set `METRICS_COLLECTOR` to
+the dotted path of a `Collector` subclass, e.g.
+`'jwt_auth.metrics.InMemoryCollector'`, or call `set_collector`, to keep them.
+"""
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+from typing import Dict, List, Tuple
+
+# Prefix of the exported metric names.
+PREFIX = 'jwt_auth_'
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Collector:
+    """Receives the metrics of the authentication path and discards them.
+
+    Subclasses override `increment` and `observe` to keep them.
+    """
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """Add to a counter.
+
+        Args:
+            name: The name of the counter, e.g. `token_cache_hits_total`.
+            value: The amount to add.
+        """
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record a latency.
+
+        Args:
+            name: The name of the histogram, e.g. `token_parse_seconds`.
+            seconds: The latency.
+        """
+
+
+class Histogram:
+    """Counts latencies in the buckets of `BUCKETS`."""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        # The last count is for latencies above the largest bucket.
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        """Record a latency."""
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Get the cumulative count of each bucket, by upper bound."""
+        bounds = [repr(bound) for bound in BUCKETS] + ['+Inf']
+        counts = []
+        total = 0
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            counts.append((bound, total))
+        return counts
+
+
+class InMemoryCollector(Collector):
+    """Keeps the counters and latency histograms in memory."""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def reset(self) -> None:
+        """Forget all the metrics."""
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def to_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append('# TYPE %s%s counter' % (PREFIX, name))
+                lines.append('%s%s %d' % (PREFIX, name, value))
+            for name, histogram in sorted(self.histograms.items()):
+                lines.append('# TYPE %s%s histogram' % (PREFIX, name))
+                for bound, count in histogram.cumulative():
+                    lines.append('%s%s_bucket{le="%s"} %d' % (
+                        PREFIX, name, bound, count,
+                    ))
+                lines.append('%s%s_sum %r' % (PREFIX, name, histogram.sum))
+                lines.append('%s%s_count %d' % (
+                    PREFIX, name, histogram.count,
+                ))
+        return '\n'.join(lines) + '\n'
+
+
+class _Timer:
+    """Records the time spent in a `with` block."""
+
+    __slots__ = ('collector', 'name', 'start')
+
+    def __init__(self, collector: Collector, name: str):
+        self.collector = collector
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.collector.observe(self.name, time.perf_counter() - self.start)
+
+
+NULL_COLLECTOR = Collector()
+_NULL_TIMER = nullcontext()
+
+_collector: Collector = NULL_COLLECTOR
+
+
+def get_collector() -> Collector:
+    """Get the current collector."""
+    return _collector
+
+
+def set_collector(collector: Collector) -> None:
+    """Replace the current collector.
+
+    Args:
+        collector: The collector, `NULL_COLLECTOR` to discard the metrics.
+    """
+    global _collector
+
+    _collector = collector
+
+
+def increment(name: str, value: int = 1) -> None:
+    """Add to a counter of the current collector."""
+    _collector.increment(name, value)
+
+
+def timer(name: str):
+    """Time a `with` block in a histogram of the current collector.
+
+    Nothing is timed while the metrics are discarded.
+    """
+    collector = _collector
+    if collector is NULL_COLLECTOR:
+        return _NULL_TIMER
+    return _Timer(collector, name)
@@ -1,37 +1,140 @@
 """Holds the data structures for this app.
 """
-from typing import Optional
+import logging
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import (
+    Any, Dict, FrozenSet, Iterable, Mapping, Optional, Tuple, Union,
+)
 from uuid import UUID
 
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+# Shared by the users that have no authorization data yet.
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+
+class Subscription:
+    """Represents a subscription, with its dates parsed.
+
+    Dates without a timezone are assumed to be in UTC.
+    """
+
+    __slots__ = ('plan', 'status', 'start_date_time', 'end_date_time')
+
+    def __init__(
+        self,
+        plan: Optional[str],
+        status: Optional[str],
+        start_date_time: Optional[datetime] = None,
+        end_date_time: Optional[datetime] = None,
+    ):
+        self.plan = plan
+        self.status = status
+        self.start_date_time = start_date_time
+        self.end_date_time = end_date_time
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Subscription':
+        """Parse a subscription
+
+        Args:
+            data: The subscription, as returned by the PERMISSION_ENDPOINT.
+
+        Returns:
+            The parsed subscription.
+        """
+        return cls(
+            plan=data.get('plan'),
+            status=data.get('status'),
+            start_date_time=_parse_datetime(data.get('start_date_time')),
+            end_date_time=_parse_datetime(data.get('end_date_time')),
+        )
+
+    def is_active(self, now: datetime) -> bool:
+        """Check if the subscription is active and not expired
+
+        Args:
+            now: The current date and time.
+
+        Returns:
+            `True` if the subscription is active at `now`, `False` otherwise.
+        """
+        return (
+            self.status == 'active'
+            and (self.start_date_time is None or self.start_date_time <= now)
+            and (self.end_date_time is None or now < self.end_date_time)
+        )
+
 
 class User:
     """Represents a user.
+
+    The authorization data is shared with the caller by reference and must
+    not be modified once set.
     """
 
+    __slots__ = (
+        '_uuid_string',
+        '_uuid',
+        '_email',
+        '_subscription',
+        '_subscriptions',
+        '_is_signup_only',
+        '_properties',
+        '_authorization',
+        '_roles',
+        '_groups',
+        '_group_set',
+    )
+
     def __init__(
         self,
-        uuid: str,
+        uuid: Union[str, UUID],
         email: str,
         subscription: Optional[dict] = None,
         signup_only: bool = False,
         **kwargs
     ):
-        self._uuid = UUID(uuid)
+        # The uuid is only parsed when it is read.
+        self._uuid_string = str(uuid)
+        self._uuid = uuid if isinstance(uuid, UUID) else None
         self._email = email
-        self._subscription = subscription or {}
+        self._set_subscription(subscription or {})
         self._is_signup_only = signup_only
         self._properties = kwargs
+        self._authorization: Mapping[str, Any] = _EMPTY
+        self._roles: Mapping[str, Any] = _EMPTY
+        self._groups: Tuple[str, ...] = ()
+        self._group_set: FrozenSet[str] = frozenset()
 
     def __getattr__(self, name: str):
         """Allow dot notation access to the user's properties
 
+        The authorization data is looked up first, then the roles and then
+        the properties the user was created with.
+
         Args:
             name: The name of the property
 
         Returns:
             The value of the property
         """
-        return self._properties[name]
+        # Private names are never properties. This also avoids recursing
+        # when the slots are not set yet, e.g. while unpickling.
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name in self._authorization and name != 'role':
+            return self._authorization[name]
+        if name in self._roles:
+            return self._roles[name]
+        try:
+            return self._properties[name]
+        except KeyError:
+            raise AttributeError(name)
 
     @property
     def email(self) -> str:
@@ -43,7 +146,10 @@ class User:
     def uuid(self) -> UUID:
         """Read only property containing the user's uuid
         """
-        return self._uuid
+        uuid = self._uuid
+        if uuid is None:
+            uuid = self._uuid = UUID(self._uuid_string)
+        return uuid
 
     @property
     def id(self) -> UUID:
@@ -75,6 +181,53 @@ class User:
         """
         return self._subscription
 
+    @property
+    def subscriptions(self) -> Mapping[str, Tuple[Subscription, ...]]:
+        """The user's parsed subscriptions, grouped by plan
+        """
+        return self._subscriptions
+
+    @property
+    def groups(self) -> tuple:
+        """The names of the groups the user belongs to
+        """
+        return self._groups
+
+    def has_group(self, name: str) -> bool:
+        """Check if the user belongs to a group
+
+        Args:
+            name: The name of the group
+
+        Returns:
+            `True` if the user belongs to the group, `False` otherwise.
+        """
+        return name in self._group_set
+
+    def has_any_group(self, *names: str) -> bool:
+        """Check if the user belongs to any of the given groups
+
+        Args:
+            names: The names of the groups
+
+        Returns:
+            `True` if the user belongs to at least one of the groups, `False`
+            otherwise.
+        """
+        return not self._group_set.isdisjoint(names)
+
+    def has_all_groups(self, *names: str) -> bool:
+        """Check if the user belongs to all the given groups
+
+        Args:
+            names: The names of the groups
+
+        Returns:
+            `True` if the user belongs to every one of the groups, `False`
+            otherwise.
+        """
+        return self._group_set.issuperset(names)
+
     def set_authorization(self, authorization: dict):
         """Sets the user's authorization data.
 
@@ -98,11 +251,15 @@ class User:
                     },
                 }
         """
-        data = authorization.copy()
-        self._set_roles(data.pop('role'))
-        self._set_subscription(data.pop('subscription'))
-        self._properties['is_active'] = data.pop('is_active')
-        self._properties.update(**data)
+        # Validate the required fields before setting anything.
+        roles = authorization['role']
+        subscription = authorization['subscription']
+        if 'is_active' not in authorization:
+            raise KeyError('is_active')
+
+        self._authorization = authorization
+        self._set_roles(roles)
+        self._set_subscription(subscription)
 
     def set_service(self) -> None:
         """Sets the system service user."""
@@ -113,19 +270,48 @@ class User:
             'groups': ['Service'],
         })
 
-    def check_subscription(self, name: str) -> bool:
+    def check_subscription(
+        self,
+        name: str,
+        now: Optional[datetime] = None,
+    ) -> bool:
         """Check if the user has an un-expired subscription of the given type
 
         Args:
             name: The name of the subscription
+            now: The date and time to check at, defaults to the current one.
 
         Returns:
             `True` if the user has the given subscription and it is not
             expired, `False` otherwise.
         """
-        has_plan = self.subscription['plan'] == name
-        not_expired = self.subscription['status'] == 'active'
-        return has_plan and not_expired
+        now = _aware(now)
+        return any(
+            subscription.is_active(now)
+            for subscription in self._subscriptions.get(name, ())
+        )
+
+    def check_any_subscription(
+        self,
+        names: Iterable[str],
+        now: Optional[datetime] = None,
+    ) -> bool:
+        """Check if the user has an un-expired subscription of any given type
+
+        Args:
+            names: The names of the subscriptions
+            now: The date and time to check at, defaults to the current one.
+
+        Returns:
+            `True` if the user has one of the given subscriptions and it is
+            not expired, `False` otherwise.
+        """
+        now = _aware(now)
+        for name in names:
+            for subscription in self._subscriptions.get(name, ()):
+                if subscription.is_active(now):
+                    return True
+        return False
 
     def _set_roles(self, roles: dict):
         """Adds the given roles to this user.
@@ -141,11 +327,17 @@ class User:
                     'groups': ['Admin', 'Writer'],
                 }
         """
-        self._properties.update(**roles)
+        self._roles = roles
+        self._groups = tuple(roles.get('groups', ()))
+        self._group_set = frozenset(self._groups)
 
-    def _set_subscription(self, subscription: dict):
+    def _set_subscription(self, subscription: Union[dict, list]):
         """Sets the user's subscriptions.
 
+        The subscriptions are parsed once and grouped by plan. A list of
+        subscriptions is also accepted, in which a plan may appear more than
+        once, e.g. an active subscription next to an ended one.
+
         Example:
             The subscriptions must be of the form::
                 {
@@ -156,3 +348,40 @@ class User:
                 }
         """
         self._subscription = subscription
+        if isinstance(subscription, dict):
+            subscription = [subscription]
+        subscriptions: Dict[str, Tuple[Subscription, ...]] = {}
+        for data in subscription:
+            plan = data.get('plan')
+            if plan is not None:
+                subscriptions[plan] = subscriptions.get(plan, ()) + (
+                    Subscription.from_dict(data),
+                )
+        self._subscriptions = subscriptions
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    """Parse an ISO 8601 date and time, assuming UTC without a timezone.
+
+    Missing and invalid dates are ignored rather than failing the whole
+    authorization, leaving the subscription unbounded on that side.
+    """
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except (TypeError, ValueError):
+        parsed = None
+    if parsed is None:
+        logger.warning('Ignoring invalid subscription date %r.', value)
+        return None
+    return _aware(parsed)
+
+
+def _aware(value: Optional[datetime]) -> datetime:
+    """Get the given, or the current, date and time with a timezone."""
+    if value is None:
+        return datetime.now(timezone.utc)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
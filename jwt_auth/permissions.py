@@ -0,0 +1,68 @@
+"""Provides permission classes based on the user's groups."""
+from typing import FrozenSet, Type
+
+from django.http import HttpRequest
+from rest_framework.permissions import BasePermission
+
+
+class HasAnyGroup(BasePermission):
+    """Allows access to users who belong to any of the `groups`
+
+    Example:
+        Subclass it to set the groups::
+
+            class IsEditor(HasAnyGroup):
+                groups = frozenset(['Admin', 'Writer'])
+
+        or use `any_group`::
+
+            permission_classes = [any_group('Admin', 'Writer')]
+    """
+
+    groups: FrozenSet[str] = frozenset()
+
+    def has_permission(self, request: HttpRequest, view) -> bool:
+        """Check if the user belongs to any of the groups."""
+        has_any_group = getattr(request.user, 'has_any_group', None)
+        return has_any_group is not None and has_any_group(*self.groups)
+
+
+class HasAllGroups(BasePermission):
+    """Allows access to users who belong to all the `groups`
+
+    Example:
+        Subclass it to set the groups, or use `all_groups`::
+
+            permission_classes = [all_groups('Admin', 'Writer')]
+    """
+
+    groups: FrozenSet[str] = frozenset()
+
+    def has_permission(self, request: HttpRequest, view) -> bool:
+        """Check if the user belongs to all the groups."""
+        has_all_groups = getattr(request.user, 'has_all_groups', None)
+        return has_all_groups is not None and has_all_groups(*self.groups)
+
+
+def any_group(*names: str) -> Type[HasAnyGroup]:
+    """Make a permission class for users in any of the given groups.
+
+    Args:
+        names: The names of the groups.
+
+    Returns:
+        The permission class.
+    """
+    return type('HasAnyGroup', (HasAnyGroup,), {'groups': frozenset(names)})
+
+
+def all_groups(*names: str) -> Type[HasAllGroups]:
+    """Make a permission class for users in all the given groups.
+
+    Args:
+        names: The names of the groups.
+
+    Returns:
+        The permission class.
+    """
+    return type('HasAllGroups', (HasAllGroups,), {'groups': frozenset(names)})
@@ -1,6 +1,6 @@
 from requests.auth import AuthBase
 
-from django.conf import settings
+from jwt_auth.conf import get_config
 
 
 class ServiceRequestAuth(AuthBase):
@@ -8,7 +8,7 @@ class ServiceRequestAuth(AuthBase):
 
     def __call__(self, req):
         """Custom implementation for authentication."""
-        token = settings.JWT_AUTH['SERVICE_SECRET_TOKEN']
+        token = get_config().service_secret_token
 
         # Set the token in the request
         req.headers['Token'] = token
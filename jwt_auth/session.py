@@ -0,0 +1,131 @@
+"""Provides the HTTP session shared by the requests to other services."""
+import asyncio
+import threading
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import TYPE_CHECKING, Optional
+from weakref import WeakKeyDictionary
+
+import requests
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from jwt_auth.conf import get_config
+
+if TYPE_CHECKING:
+    import httpx
+else:
+    try:
+        import httpx
+    except ImportError:  # pragma: no cover
+        httpx = None
+
+# Server errors that are retried, as they are usually transient.
+RETRY_STATUSES = (502, 503, 504)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# Asynchronous clients are bound to an event loop, so one is kept per loop.
+_async_clients: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def get_session() -> requests.Session:
+    """Get the shared session.
+
+    The session keeps connections alive in a pool sized by `HTTP_POOL_SIZE`
+    and retries failed GET requests with an exponential backoff.
+
+    Returns:
+        The session.
+    """
+    global _session
+
+    session = _session
+    if session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _make_session()
+            session = _session
+    return session
+
+
+def get_async_client() -> 'httpx.AsyncClient':
+    """Get the asynchronous client shared within the running event loop.
+
+    The client keeps up to `HTTP_POOL_SIZE` connections alive and requires
+    the optional `httpx` dependency.
+
+    Returns:
+        The client.
+    """
+    if httpx is None:
+        raise ImproperlyConfigured(
+            'httpx must be installed for asynchronous authentication.'
+        )
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = _make_async_client()
+    return client
+
+
+def reset_session() -> None:
+    """Close the shared session so a new one is made on the next request."""
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting: str, **kwargs) -> None:
+    if setting == 'JWT_AUTH':
+        reset_session()
+
+
+def _make_session() -> requests.Session:
+    config = get_config()
+    retry = Retry(
+        total=config.http_retries,
+        backoff_factor=config.http_backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=config.http_pool_size,
+        pool_maxsize=config.http_pool_size,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # The session is shared by all requests, so it must not keep cookies
+    # from one response to the next.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def _make_async_client() -> 'httpx.AsyncClient':
+    config = get_config()
+    limits = httpx.Limits(
+        max_connections=config.http_pool_size,
+        max_keepalive_connections=config.http_pool_size,
+    )
+    # httpx only retries failed connections.
+    transport = httpx.AsyncHTTPTransport(
+        limits=limits,
+        retries=config.http_retries,
+    )
+    return httpx.AsyncClient(
+        transport=transport,
+        cookies=httpx.Cookies(
+            CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+        ),
+    )
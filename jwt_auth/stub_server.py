@@ -0,0 +1,347 @@
+"""A local stand-in for the JWKS and permission endpoints.
+
+The stub server generates its own RSA keys, signs tokens with them and serves
+canned authorization data, so the library can be load tested without the
+real services:
+
+    python -m jwt_auth.stub_server --port 8000 --latency 0.005 \\
+        --error-rate 0.01 --rotate-every 300
+
+Then point `JWKS_ENDPOINT` to `http://127.0.0.1:8000/jwks`,
+`PERMISSION_ENDPOINT` to `http://127.0.0.1:8000/permissions` and
+`PERMISSION_BULK_ENDPOINT` to `http://127.0.0.1:8000/permissions/bulk`.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric.rsa import (
+    RSAPrivateKey, generate_private_key,
+)
+from jwt.algorithms import RSAAlgorithm
+
+# Served for every user unless other data is given.
+DEFAULT_AUTHORIZATION = {
+    'is_active': True,
+    'role': {
+        'is_staff': False,
+        'is_superuser': False,
+        'groups': ['Reader'],
+    },
+    'subscription': {
+        'plan': 'professional-monthly',
+        'status': 'active',
+        'start_date_time': '2019-01-03T17:41:42Z',
+        'end_date_time': '2099-09-03T16:41:42Z',
+    },
+}
+
+
+def make_key(kid: str) -> Tuple[RSAPrivateKey, dict]:
+    """Generate an RSA key.
+
+    Args:
+        kid: The kid of the key.
+
+    Returns:
+        The private key and its public JWK.
+    """
+    private_key = generate_private_key(
+        public_exponent=65537,
+        key_size=2048,
+        backend=default_backend(),
+    )
+    jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update(kid=kid, alg='RS256', use='sig')
+    return private_key, jwk
+
+
+class StubServer:
+    """Serves a generated key set and canned authorization data.
+
+    The server listens on a local port in daemon threads and serves:
+
+    - `/jwks`, the key set, with an `ETag` and a `Cache-Control: max-age`.
+    - `/permissions?uuid=...`, the authorization data of a user.
+    - `/permissions/bulk?uuid=...&uuid=...`, the data of several users.
+
+    Each request is delayed by `latency` seconds, plus up to `jitter`
+    seconds, and fails with a 503 status with a probability of `error_rate`.
+    A new key is generated every `rotate_every` seconds, the key set keeping
+    the `retained_keys` most recent keys. When `service_token` is set, the
+    permission endpoints require it in the `Token` header.
+    """
+
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            authorization: Optional[dict] = None,
+            latency: float = 0,
+            jitter: float = 0,
+            error_rate: float = 0,
+            rotate_every: float = 0,
+            retained_keys: int = 2,
+            jwks_max_age: int = 300,
+            service_token: str = '',
+    ):
+        self.authorization = authorization or DEFAULT_AUTHORIZATION
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rotate_every = rotate_every
+        self.retained_keys = retained_keys
+        self.jwks_max_age = jwks_max_age
+        self.service_token = service_token
+        # Requests served, by path, and failed on purpose.
+        self.requests: Counter = Counter()
+        self.errors = 0
+
+        self._keys: List[Tuple[str, RSAPrivateKey, dict]] = []
+        self._rotations = 0
+        self._rotated_at = 0.0
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._random = random.Random()
+        self.rotate()
+
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'StubServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """The base URL of the server."""
+        host, port = self._server.server_address[:2]
+        if isinstance(host, bytes):
+            host = host.decode()
+        return 'http://%s:%d' % (host, port)
+
+    @property
+    def kid(self) -> str:
+        """The kid of the key tokens are signed with."""
+        return self._keys[-1][0]
+
+    @property
+    def jwks(self) -> dict:
+        """The key set currently served."""
+        return {'keys': [jwk for _, _, jwk in self._keys]}
+
+    def start(self) -> 'StubServer':
+        """Serve in a daemon thread."""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name='jwt-auth-stub-server',
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve in the calling thread until interrupted."""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def rotate(self) -> str:
+        """Generate a new signing key, dropping the oldest retained one.
+
+        Returns:
+            The kid of the new key.
+        """
+        with self._lock:
+            return self._add_key()
+
+    def sign(self, payload: Optional[dict] = None, **claims) -> str:
+        """Sign a token with the current key.
+
+        Args:
+            payload: The payload, a new user valid for an hour by default.
+            claims: Claims added to the payload.
+
+        Returns:
+            The RS256 token.
+        """
+        self._rotate_if_due()
+        if payload is None:
+            payload = {
+                'uuid': str(uuid4()),
+                'email': 'user@example.com',
+                'exp': int(time.time()) + 3600,
+            }
+        kid, private_key, _ = self._keys[-1]
+        return jwt.encode(
+            dict(payload, **claims), private_key, 'RS256',
+            headers={'kid': kid},
+        ).decode()
+
+    def _rotate_if_due(self) -> None:
+        if not self.rotate_every:
+            return
+        with self._lock:
+            if time.monotonic() - self._rotated_at >= self.rotate_every:
+                self._add_key()
+
+    def _add_key(self) -> str:
+        self._rotations += 1
+        kid = 'stub-%d' % self._rotations
+        private_key, jwk = make_key(kid)
+        self._keys = (self._keys + [(kid, private_key, jwk)])[
+            -max(self.retained_keys, 1):
+        ]
+        self._rotated_at = time.monotonic()
+        return kid
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, so Nagle's algorithm
+            # would delay every response.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                with stub._stats_lock:
+                    stub.requests[url.path] += 1
+                    delay = stub.latency + stub._random.uniform(
+                        0, stub.jitter,
+                    )
+                    failed = stub._random.random() < stub.error_rate
+                    if failed:
+                        stub.errors += 1
+                if delay:
+                    time.sleep(delay)
+                if failed:
+                    self._send(503, {'detail': 'Stub error.'})
+                    return
+
+                if url.path == '/jwks':
+                    self._send_jwks()
+                    return
+                if not url.path.startswith('/permissions'):
+                    self._send(404, {'detail': 'Not found.'})
+                    return
+                if stub.service_token \
+                        and self.headers.get('Token') != stub.service_token:
+                    self._send(401, {'detail': 'Invalid token.'})
+                    return
+
+                uuids = parse_qs(url.query).get('uuid', [])
+                if url.path == '/permissions/bulk':
+                    self._send(200, {
+                        uuid: stub.authorization for uuid in uuids
+                    })
+                elif url.path == '/permissions' and uuids:
+                    self._send(200, stub.authorization)
+                else:
+                    self._send(404, {'detail': 'Not found.'})
+
+            def _send_jwks(self):
+                stub._rotate_if_due()
+                content = json.dumps(stub.jwks).encode()
+                etag = '"%s"' % hashlib.sha1(content).hexdigest()
+                headers = {
+                    'ETag': etag,
+                    'Cache-Control': 'max-age=%d' % stub.jwks_max_age,
+                }
+                if self.headers.get('If-None-Match') == etag:
+                    self._send(304, None, headers)
+                else:
+                    self._send(200, content, headers)
+
+            def _send(self, status, body, headers=None):
+                if body is None:
+                    content = b''
+                elif isinstance(body, bytes):
+                    content = body
+                else:
+                    content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description='Serve stand-in JWKS and permission endpoints.',
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument(
+        '--latency', type=float, default=0,
+        help='seconds each request is delayed by',
+    )
+    parser.add_argument(
+        '--jitter', type=float, default=0,
+        help='maximum random seconds added to the latency',
+    )
+    parser.add_argument(
+        '--error-rate', type=float, default=0,
+        help='fraction of the requests answered with a 503 status',
+    )
+    parser.add_argument(
+        '--rotate-every', type=float, default=0,
+        help='seconds after which a new signing key is generated',
+    )
+    parser.add_argument(
+        '--jwks-max-age', type=int, default=300,
+        help='max-age of the key set, in seconds',
+    )
+    parser.add_argument(
+        '--service-token', default='',
+        help='token required by the permission endpoints',
+    )
+    args = parser.parse_args(argv)
+
+    server = StubServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rotate_every=args.rotate_every,
+        jwks_max_age=args.jwks_max_age,
+        service_token=args.service_token,
+    )
+    print('Serving on %s' % server.url)
+    print('Sample token: JWT %s' % server.sign())
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
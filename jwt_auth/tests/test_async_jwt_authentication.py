@@ -0,0 +1,140 @@
+"""Tests for the AsyncJWTAuthentication class
+"""
+import asyncio
+import time
+from unittest import mock
+from uuid import uuid4
+
+import pytest
+from django.http import HttpRequest
+from django.test import override_settings
+from rest_framework.exceptions import AuthenticationFailed
+
+from jwt_auth.authentication import AUTHORIZATION_CACHE, \
+    AsyncJWTAuthentication
+from jwt_auth.tests.fixtures import *  # noqa
+
+httpx = pytest.importorskip('httpx')
+
+
+def run_with_endpoint(coroutine_function, authorization: dict):
+    """Run a coroutine with a stub PERMISSION_ENDPOINT.
+
+    Returns:
+        The result of the coroutine and the requests made to the endpoint.
+    """
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json=authorization)
+
+    async def main():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with mock.patch(
+            'jwt_auth.authentication.get_async_client',
+            return_value=client,
+        ):
+            return await coroutine_function()
+
+    return asyncio.run(main()), requests
+
+
+JWT_AUTH = {
+    'KEYS': ['secret'],
+    'PERMISSION_ENDPOINT': 'http://test.com',
+    'SERVICE_SECRET_TOKEN': 'super secret',
+}
+
+
+class TestAauthenticate:
+    """Test the AsyncJWTAuthentication.aauthenticate function
+    """
+
+    @staticmethod
+    def setup_method():
+        AUTHORIZATION_CACHE.clear()
+
+    @staticmethod
+    @override_settings(JWT_AUTH=JWT_AUTH)
+    def test_no_token():
+        """Test when there is no Authorization header
+        """
+        request = HttpRequest()
+
+        assert asyncio.run(
+            AsyncJWTAuthentication().aauthenticate(request),
+        ) is None
+
+    @staticmethod
+    @override_settings(JWT_AUTH=dict(
+        JWT_AUTH, AUTHORIZATION_CLAIM='authorization',
+    ))
+    def test_invalid_uuid(make_jwt, make_authorization_data):
+        """Test that the uuid is validated when the claim is used
+        """
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = 'JWT ' + make_jwt(
+            uuid='not-a-uuid',
+            email='user@example.com',
+            iat=int(time.time()),
+            authorization=make_authorization_data(),
+        )
+
+        with pytest.raises(AuthenticationFailed):
+            asyncio.run(AsyncJWTAuthentication().aauthenticate(request))
+
+    @staticmethod
+    @override_settings(JWT_AUTH=JWT_AUTH)
+    def test_bad_jwt():
+        """Test when we have a bad JWT
+        """
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = 'JWT some random string'
+
+        with pytest.raises(AuthenticationFailed):
+            asyncio.run(AsyncJWTAuthentication().aauthenticate(request))
+
+    @staticmethod
+    @override_settings(JWT_AUTH=JWT_AUTH)
+    def test_valid_jwt(make_jwt, make_authorization_data):
+        """Test that the user is authenticated with its authorization
+        """
+        user_id = uuid4()
+        token = make_jwt(
+            key='secret', uuid=str(user_id), email='user@example.com',
+        )
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = 'JWT ' + token
+
+        (user, auth), requests = run_with_endpoint(
+            lambda: AsyncJWTAuthentication().aauthenticate(request),
+            make_authorization_data(),
+        )
+
+        assert auth == token
+        assert user.uuid == user_id
+        assert user.is_active
+        assert requests[0].url.params['uuid'] == str(user_id)
+        assert requests[0].headers['Token'] == 'super secret'
+
+    @staticmethod
+    @override_settings(JWT_AUTH=JWT_AUTH)
+    def test_concurrent(make_authorization_data):
+        """Test that concurrent lookups of a user share one request
+        """
+        user_id = uuid4()
+
+        async def lookups():
+            return await asyncio.gather(*(
+                AsyncJWTAuthentication._aget_authorization(user_id)
+                for _ in range(10)
+            ))
+
+        results, requests = run_with_endpoint(
+            lookups, make_authorization_data(),
+        )
+
+        assert len(requests) == 1
+        assert all(result == results[0] for result in results)
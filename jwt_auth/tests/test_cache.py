@@ -0,0 +1,149 @@
+"""Tests for the caches
+"""
+from unittest import mock
+
+from django.core.cache import caches
+
+from jwt_auth.cache import AuthorizationCache, LRUCache
+
+
+class TestLRUCache:
+    """Test the LRUCache class."""
+
+    @staticmethod
+    def test_get():
+        """Test that a cached value is returned and counted as a hit."""
+        cache = LRUCache()
+        cache.set('key', 'value', expires_at=200)
+
+        assert cache.get('key', now=100) == 'value'
+        assert cache.get('other', now=100) is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    @staticmethod
+    def test_expiry():
+        """Test that values are only returned in their validity window."""
+        cache = LRUCache()
+        cache.set('key', 'value', expires_at=200, not_before=100)
+
+        assert cache.get('key', now=50) is None
+        assert cache.get('key', now=150) == 'value'
+        assert cache.get('key', now=200) is None
+        assert len(cache) == 0
+
+    @staticmethod
+    def test_stale():
+        """Test that expired values are only returned by get_stale."""
+        cache = LRUCache()
+        cache.stale_ttl = 100
+        cache.set('key', 'value', expires_at=200)
+
+        assert cache.get('key', now=250) is None
+        assert cache.get_stale('key', now=250) == 'value'
+        assert cache.get_stale('key', now=300) is None
+        assert cache.get('key', now=300) is None
+        assert len(cache) == 0
+
+    @staticmethod
+    def test_max_entries():
+        """Test that the least recently used entry is evicted."""
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1, expires_at=200)
+        cache.set('b', 2, expires_at=200)
+        cache.get('a', now=100)
+        cache.set('c', 3, expires_at=200)
+
+        assert cache.get('a', now=100) == 1
+        assert cache.get('b', now=100) is None
+        assert cache.get('c', now=100) == 3
+
+    @staticmethod
+    def test_max_bytes():
+        """Test that entries are evicted to stay within max_bytes."""
+        cache = LRUCache(max_bytes=100)
+        cache.set('a', 1, expires_at=200, size=60)
+        cache.set('b', 2, expires_at=200, size=30)
+        cache.set('c', 3, expires_at=200, size=30)
+
+        assert cache.get('a', now=100) is None
+        assert cache.size == 60
+
+
+class TestAuthorizationCache:
+    """Test the AuthorizationCache class."""
+
+    @staticmethod
+    def make_cache(**kwargs) -> AuthorizationCache:
+        cache = AuthorizationCache()
+        cache.ttl = 60
+        for name, value in kwargs.items():
+            setattr(cache, name, value)
+        return cache
+
+    def test_local(self):
+        """Test that values are cached in process."""
+        cache = self.make_cache()
+        cache.set('uuid1', {'is_active': True})
+
+        assert cache.get('uuid1') == {'is_active': True}
+        assert cache.get('uuid2') is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_shared(self):
+        """Test that values are shared through the Django cache."""
+        caches['default'].clear()
+        writer = self.make_cache(alias='default')
+        reader = self.make_cache(alias='default')
+
+        writer.set_many({
+            'uuid1': {'is_active': True},
+            'uuid2': {'is_active': False},
+        })
+
+        assert reader.get_many(['uuid1', 'uuid2', 'uuid3']) == {
+            'uuid1': {'is_active': True},
+            'uuid2': {'is_active': False},
+        }
+        assert caches['default'].get(
+            AuthorizationCache.KEY_PREFIX + 'uuid1',
+        ).endswith(',{"is_active":true}]')
+        # The shared values are kept in process once read.
+        assert reader.local.get('uuid1') == {'is_active': True}
+
+    def test_shared_only(self):
+        """Test that the in-process cache can be disabled."""
+        caches['default'].clear()
+        cache = self.make_cache(alias='default', local_enabled=False)
+        cache.set('uuid1', {'is_active': True})
+
+        assert cache.get('uuid1') == {'is_active': True}
+        assert len(cache.local) == 0
+
+    def test_shared_error(self):
+        """Test that errors of the shared cache are treated as misses."""
+        cache = self.make_cache(alias='default', local_enabled=False)
+
+        with mock.patch('jwt_auth.cache.caches') as django_caches:
+            django_caches.__getitem__.side_effect = ConnectionError()
+            cache.set('uuid1', {'is_active': True})
+
+            assert cache.get('uuid1') is None
+
+    def test_stale(self):
+        """Test that expired values are served stale within the window."""
+        caches['default'].clear()
+        writer = self.make_cache(alias='default', stale_ttl=60)
+        writer.local.stale_ttl = 60
+        reader = self.make_cache(alias='default', local_enabled=False,
+                                 stale_ttl=60)
+        writer.set('uuid1', {'is_active': True})
+        later = writer.local._entries['uuid1'][2] + 30
+
+        with mock.patch('jwt_auth.cache.time.time', return_value=later):
+            assert writer.get('uuid1') is None
+            assert writer.get_stale_many(['uuid1']) == {
+                'uuid1': {'is_active': True},
+            }
+            assert reader.get_stale_many(['uuid1', 'uuid2']) == {
+                'uuid1': {'is_active': True},
+            }
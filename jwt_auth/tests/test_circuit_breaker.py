@@ -0,0 +1,134 @@
+"""Tests for the circuit breaker
+"""
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+
+from jwt_auth.circuit_breaker import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError,
+)
+
+
+def make_circuit(**kwargs) -> CircuitBreaker:
+    circuit = CircuitBreaker('test', **kwargs)
+    circuit.failure_threshold = 2
+    circuit.reset_timeout = 30
+    return circuit
+
+
+def fail():
+    raise ConnectionError()
+
+
+class TestCircuitBreaker:
+    """Test the CircuitBreaker class."""
+
+    @staticmethod
+    def test_opens():
+        """Test that the circuit opens after consecutive failures."""
+        circuit = make_circuit()
+
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                circuit.call(fail)
+        function = mock.Mock()
+        with pytest.raises(CircuitOpenError):
+            circuit.call(function)
+
+        assert circuit.state == OPEN
+        function.assert_not_called()
+
+    @staticmethod
+    def test_success_resets():
+        """Test that a success resets the count of failures."""
+        circuit = make_circuit()
+
+        with pytest.raises(ConnectionError):
+            circuit.call(fail)
+        assert circuit.call(lambda: 'value') == 'value'
+        with pytest.raises(ConnectionError):
+            circuit.call(fail)
+
+        assert circuit.state == CLOSED
+
+    @staticmethod
+    def test_not_failures():
+        """Test that errors that are not failures do not open it."""
+        circuit = make_circuit(is_failure=lambda ex: False)
+
+        for _ in range(3):
+            with pytest.raises(ConnectionError):
+                circuit.call(fail)
+
+        assert circuit.state == CLOSED
+
+    @staticmethod
+    def test_trial():
+        """Test that a single trial is let through after the timeout."""
+        circuit = make_circuit()
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                circuit.call(fail)
+        later = time.monotonic() + 30
+
+        with mock.patch(
+            'jwt_auth.circuit_breaker.time.monotonic', return_value=later,
+        ):
+            assert circuit.state == HALF_OPEN
+            with pytest.raises(ConnectionError):
+                circuit.call(fail)
+            assert circuit.state == OPEN
+
+        with mock.patch(
+            'jwt_auth.circuit_breaker.time.monotonic',
+            return_value=later + 30,
+        ):
+            assert circuit.call(lambda: 'value') == 'value'
+
+        assert circuit.state == CLOSED
+
+    @staticmethod
+    def test_async():
+        """Test that coroutines are called through the circuit."""
+        circuit = make_circuit()
+
+        async def afail():
+            raise ConnectionError()
+
+        async def calls():
+            for _ in range(2):
+                with pytest.raises(ConnectionError):
+                    await circuit.acall(afail)
+            with pytest.raises(CircuitOpenError):
+                await circuit.acall(afail)
+
+        asyncio.run(calls())
+
+    @staticmethod
+    def test_cancelled_trial():
+        """Test that a cancelled trial lets another trial through."""
+        circuit = make_circuit()
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                circuit.call(fail)
+        later = time.monotonic() + 30
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        async def succeed():
+            return 'value'
+
+        async def trials():
+            with pytest.raises(asyncio.CancelledError):
+                await circuit.acall(cancelled)
+            return await circuit.acall(succeed)
+
+        with mock.patch(
+            'jwt_auth.circuit_breaker.time.monotonic', return_value=later,
+        ):
+            assert asyncio.run(trials()) == 'value'
+
+        assert circuit.state == CLOSED
@@ -0,0 +1,170 @@
+"""Tests for the concurrency helpers
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from jwt_auth.concurrency import (
+    AsyncSingleFlight, MicroBatcher, SingleFlight,
+)
+
+
+class TestSingleFlight:
+    """Test the SingleFlight class."""
+
+    @staticmethod
+    def test_shared():
+        """Test that concurrent calls with the same key share one call."""
+        flights = SingleFlight()
+        calls = []
+
+        def function():
+            calls.append(threading.get_ident())
+            time.sleep(0.1)
+            return {'value': 1}
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(
+                lambda _: flights.do('key', function), range(8),
+            ))
+
+        assert len(calls) == 1
+        assert all(result is results[0] for result in results)
+
+    @staticmethod
+    def test_error():
+        """Test that errors are raised in all waiters and not remembered."""
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def failing():
+            started.set()
+            release.wait()
+            raise ValueError('failed')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(flights.do, 'key', failing)
+            started.wait()
+            waiter = executor.submit(flights.do, 'key', lambda: 'unused')
+            time.sleep(0.05)
+            release.set()
+
+            with pytest.raises(ValueError):
+                leader.result()
+            with pytest.raises(ValueError):
+                waiter.result()
+
+        assert flights.do('key', lambda: 'value') == 'value'
+
+
+class TestAsyncSingleFlight:
+    """Test the AsyncSingleFlight class."""
+
+    @staticmethod
+    def test_shared():
+        """Test that concurrent coroutines with the same key share one call."""
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def function():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {'value': 1}
+
+        async def lookup():
+            return await asyncio.gather(*(
+                flights.do('key', function) for _ in range(8)
+            ))
+
+        results = asyncio.run(lookup())
+
+        assert len(calls) == 1
+        assert all(result is results[0] for result in results)
+
+    @staticmethod
+    def test_leader_cancelled():
+        """Test that cancelling the first caller does not cancel the others."""
+        flights = AsyncSingleFlight()
+
+        async def function():
+            await asyncio.sleep(0.05)
+            return 'value'
+
+        async def lookup():
+            leader = asyncio.ensure_future(flights.do('key', function))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(flights.do('key', function))
+            await asyncio.sleep(0)
+            leader.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+            return await waiter
+
+        assert asyncio.run(lookup()) == 'value'
+
+
+class TestMicroBatcher:
+    """Test the MicroBatcher class."""
+
+    @staticmethod
+    def test_batched():
+        """Test that keys submitted within the window share one call."""
+        calls = []
+
+        def function(keys):
+            calls.append(keys)
+            return {key: key * 2 for key in keys}
+
+        batcher = MicroBatcher(function, window=0.05)
+        futures = [batcher.submit(key) for key in (1, 2, 3, 2)]
+
+        assert [future.result() for future in futures] == [2, 4, 6, 4]
+        assert calls == [[1, 2, 3]]
+
+    @staticmethod
+    def test_max_size():
+        """Test that a full batch is dispatched without waiting."""
+        calls = []
+
+        def function(keys):
+            calls.append(keys)
+            return {key: key for key in keys}
+
+        batcher = MicroBatcher(function, window=10, max_size=2)
+        futures = [batcher.submit(key) for key in range(4)]
+
+        assert [future.result(timeout=1) for future in futures] == \
+            [0, 1, 2, 3]
+        assert sorted(calls) == [[0, 1], [2, 3]]
+
+    @staticmethod
+    def test_errors():
+        """Test that errors and missing keys fail the futures."""
+        def failing(keys):
+            raise ValueError('failed')
+
+        batcher = MicroBatcher(failing, window=0.01)
+        with pytest.raises(ValueError):
+            batcher.submit('key').result()
+
+        batcher = MicroBatcher(lambda keys: {}, window=0.01)
+        with pytest.raises(KeyError):
+            batcher.submit('key').result()
+
+    @staticmethod
+    def test_coroutines():
+        """Test that coroutines can await the results."""
+        batcher = MicroBatcher(
+            lambda keys: {key: key.upper() for key in keys}, window=0.01,
+        )
+
+        async def lookup():
+            return await asyncio.gather(*(
+                asyncio.wrap_future(batcher.submit(key)) for key in 'ab'
+            ))
+
+        assert asyncio.run(lookup()) == ['A', 'B']
@@ -0,0 +1,75 @@
+"""Tests for the settings of the app
+"""
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+
+from jwt_auth.conf import build_config, get_config
+
+
+class TestBuildConfig:
+    """Tests for the build_config function
+    """
+
+    @staticmethod
+    def test_defaults():
+        """Test that missing settings get their default
+        """
+        config = build_config({})
+
+        assert config.keys == ()
+        assert config.service_secret_token == ''
+        assert config.verify_aud
+        assert config.jwks_max_age == 3600
+        assert config.permission_timeout == 5
+
+    @staticmethod
+    def test_keys():
+        """Test that the keys are encoded to bytes
+        """
+        assert build_config({'KEYS': ['a', 'b']}).keys == (b'a', b'b')
+        assert dict(build_config({'KEYS': {'kid': 'a'}}).keys) == {
+            'kid': b'a',
+        }
+
+    @staticmethod
+    def test_service_headers():
+        """Test that the service headers are built once
+        """
+        config = build_config({'SERVICE_SECRET_TOKEN': 'secret'})
+
+        assert dict(config.service_headers) == {'Token': 'secret'}
+
+    @staticmethod
+    @pytest.mark.parametrize('jwt_auth', [
+        [],
+        {'KEYS': 'secret'},
+        {'KEYS': [None]},
+        {'KEYS': {'kid': ''}},
+        {'PERMISSION_ENDPOINT': 1},
+        {'VERIFY_AUD': 'yes'},
+        {'TOKEN_CACHE_SIZE': -1},
+        {'TOKEN_CACHE_SIZE': 1.5},
+        {'JWKS_MAX_AGE': '60'},
+        {'AUTHORIZATION_CACHE_ALIAS': 'unknown'},
+        {'VERIFICATION_ENGINE': 'threads'},
+    ])
+    def test_invalid(jwt_auth):
+        """Test that invalid settings are rejected
+        """
+        with pytest.raises(ImproperlyConfigured):
+            build_config(jwt_auth)
+
+
+class TestGetConfig:
+    """Tests for the get_config function
+    """
+
+    @staticmethod
+    def test_setting_changed():
+        """Test that the settings are rebuilt when they change
+        """
+        with override_settings(JWT_AUTH={'PERMISSION_TIMEOUT': 1.5}):
+            assert get_config().permission_timeout == 1.5
+
+        assert get_config().permission_timeout == 5
@@ -1,10 +1,15 @@
 """Test JWKS."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
 from jwt_auth.tests.fixtures import *  # noqa
 
 import pytest
 import responses
 from django.core.exceptions import SuspiciousOperation
 from django.test import override_settings
+from django.utils.http import http_date
 from jwt import PyJWS
 
 from jwt_auth.jwks import Jwks
@@ -74,3 +79,241 @@ class TestJwks:
         )
 
         assert Jwks().get_jwk(jwt.get_unverified_header(jws)) is None
+
+    @responses.activate
+    @override_settings(JWT_AUTH={'JWKS_ENDPOINT': 'http://test.com'})
+    def test_keys_built_once(self, private_key):
+        """Test that the public keys are only built when the set loads."""
+        jws = make_jws(private_key, 'TEST')
+        header = jwt.get_unverified_header(jws)
+
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_jwks(private_key),
+        )
+        jwks = Jwks()
+        with mock.patch(
+            'jwt_auth.jwks.RSAAlgorithm.from_jwk',
+            wraps=RSAAlgorithm.from_jwk,
+        ) as from_jwk:
+            first = jwks.get_jwk(header)
+            second = jwks.get_jwk(header)
+
+        assert from_jwk.call_count == 1
+        assert first is second
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    @override_settings(JWT_AUTH={'JWKS_ENDPOINT': 'http://test.com'})
+    def test_refresh_not_modified(self, private_key):
+        """Test that an unchanged key set is revalidated with its ETag."""
+        jws = make_jws(private_key, 'TEST')
+        header = jwt.get_unverified_header(jws)
+
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_jwks(private_key),
+            headers={'ETag': '"v1"'},
+        )
+        responses.add(responses.GET, 'http://test.com', status=304)
+        jwks = Jwks()
+        key = jwks.get_jwk(header)
+
+        jwks.refresh()
+
+        assert responses.calls[1].request.headers['If-None-Match'] == '"v1"'
+        assert jwks.get_jwk(header) is key
+
+    @responses.activate
+    @override_settings(JWT_AUTH={'JWKS_ENDPOINT': 'http://test.com'})
+    def test_stale_while_revalidate(self, private_key):
+        """Test that an expired key set is served while it is refreshed."""
+        jws = make_jws(private_key, 'TEST')
+        header = jwt.get_unverified_header(jws)
+
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_jwks(private_key),
+        )
+        jwks = Jwks()
+        key = jwks.get_jwk(header)
+        jwks._expires_at = 0
+
+        with mock.patch('jwt_auth.jwks.threading.Thread') as thread:
+            assert jwks.get_jwk(header) is key
+            assert jwks.get_jwk(header) is key
+
+        # Only one revalidation is started while one is in flight.
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'JWKS_ENDPOINT': 'http://test.com',
+        'JWKS_MAX_AGE': 3600,
+        'JWKS_MIN_AGE': 10,
+        'HTTP_RETRIES': 0,
+    })
+    def test_refresh_error(self, private_key):
+        """Test that a failed refresh is retried after JWKS_MIN_AGE."""
+        header = jwt.get_unverified_header(make_jws(private_key, 'TEST'))
+
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_jwks(private_key),
+        )
+        responses.add(responses.GET, 'http://test.com', status=503)
+        jwks = Jwks()
+        key = jwks.get_jwk(header)
+
+        jwks._try_refresh()
+
+        assert jwks._expires_at - time.monotonic() <= 10
+        assert jwks.get_jwk(header) is key
+
+
+class TestLifetime:
+    """Test the freshness lifetime of a key set."""
+
+    @staticmethod
+    @override_settings(JWT_AUTH={'JWKS_MAX_AGE': 600, 'JWKS_MIN_AGE': 10})
+    def test_default():
+        """Test that JWKS_MAX_AGE is used without caching headers."""
+        assert Jwks._lifetime({}) == 600
+
+    @staticmethod
+    @override_settings(JWT_AUTH={'JWKS_MAX_AGE': 600, 'JWKS_MIN_AGE': 10})
+    def test_cache_control():
+        """Test that the Cache-Control max-age is honoured and bounded."""
+        assert Jwks._lifetime({'Cache-Control': 'public, max-age=120'}) == 120
+        assert Jwks._lifetime({'Cache-Control': 'max-age=86400'}) == 600
+        assert Jwks._lifetime({'Cache-Control': 'no-cache'}) == 10
+
+    @staticmethod
+    @override_settings(JWT_AUTH={'JWKS_MAX_AGE': 600, 'JWKS_MIN_AGE': 10})
+    def test_expires():
+        """Test that the Expires header is honoured."""
+        expires = http_date(time.time() + 300)
+
+        assert 290 <= Jwks._lifetime({'Expires': expires}) <= 300
+        assert Jwks._lifetime({'Expires': 'invalid'}) == 10
+
+
+class TestConcurrency:
+    """Test fetching the key set from several threads."""
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={'JWKS_ENDPOINT': 'http://test.com'})
+    def test_single_flight(private_key):
+        """Test that concurrent cache misses share a single fetch."""
+        jwks_data = make_jwks(private_key)
+        header = jwt.get_unverified_header(make_jws(private_key, 'TEST'))
+
+        def slow_jwks(request):
+            time.sleep(0.1)
+            return 200, {}, json.dumps(jwks_data)
+
+        responses.add_callback(
+            responses.GET, 'http://test.com', callback=slow_jwks,
+        )
+        jwks = Jwks()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            keys = list(executor.map(
+                lambda _: jwks.get_jwk(header), range(8),
+            ))
+
+        assert len(responses.calls) == 1
+        assert all(key is keys[0] for key in keys)
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={'JWKS_ENDPOINT': 'http://test.com'})
+    def test_background_refresher(private_key):
+        """Test that the refresher prefetches the key set."""
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_jwks(private_key),
+        )
+        jwks = Jwks()
+
+        jwks.start()
+        for _ in range(100):
+            if jwks._keys is not None:
+                break
+            time.sleep(0.01)
+        jwks.stop()
+
+        assert TEST_KID in jwks._keys
+        assert len(responses.calls) == 1
+
+
+class TestUnknownKid:
+    """Test refetching the key set for unknown kids."""
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'JWKS_ENDPOINT': 'http://test.com',
+        'JWKS_REFETCH_INTERVAL': 0,
+    })
+    def test_rotated_key(private_key):
+        """Test that a key added to the set is picked up."""
+        header = jwt.get_unverified_header(make_jws(private_key, 'TEST'))
+        old_jwks = make_jwks(private_key)
+        old_jwks['keys'][0]['kid'] = 'old'
+
+        responses.add(responses.GET, 'http://test.com', json=old_jwks)
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_jwks(private_key),
+        )
+        jwks = Jwks()
+
+        assert jwks.get_jwk(header) is not None
+        assert len(responses.calls) == 2
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'JWKS_ENDPOINT': 'http://test.com',
+        'JWKS_REFETCH_INTERVAL': 60,
+    })
+    def test_rate_limited(private_key):
+        """Test that unknown kids do not trigger more than one refetch."""
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_jwks(private_key),
+        )
+        jwks = Jwks()
+        jwks.refresh()
+        jwks._fetched_at -= 60
+
+        for index in range(10):
+            assert jwks.get_jwk({'kid': str(index), 'alg': 'RS256'}) is None
+
+        assert len(responses.calls) == 2
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'JWKS_ENDPOINT': 'http://test.com',
+        'JWKS_UNKNOWN_KID_CACHE_SIZE': 2,
+    })
+    def test_negative_cache_bounded(private_key):
+        """Test that the unknown kids are bounded and cleared on load."""
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_jwks(private_key),
+        )
+        jwks = Jwks()
+
+        for index in range(5):
+            jwks.get_jwk({'kid': str(index), 'alg': 'RS256'})
+
+        assert list(jwks._unknown_kids) == ['3', '4']
+
+        jwks.refresh()
+
+        assert not jwks._unknown_kids
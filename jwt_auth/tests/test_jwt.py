@@ -1,11 +1,17 @@
 """Tests for the JWT class
 """
+import json
+import time
+from unittest import mock
+
 import pytest
+from django.test import override_settings
 
 import jwt
+from jwt.utils import base64url_encode
 
 from jwt_auth.tests.fixtures import *  # noqa
-from jwt_auth.jwt import JWT
+from jwt_auth.jwt import JWKS, JWT, TOKEN_CACHE, parse, verify_many
 
 
 class TestInit:
@@ -63,3 +69,256 @@ class TestInit:
         # Test our expectataions
         with pytest.raises(jwt.InvalidSignatureError):
             token.payload
+
+
+class TestTokenCache:
+    """Test caching of verified payloads
+    """
+
+    @staticmethod
+    def setup_method():
+        TOKEN_CACHE.clear()
+
+    @staticmethod
+    @override_settings(JWT_AUTH={'TOKEN_CACHE_SIZE': 10})
+    def test_cached(make_jwt):
+        """Test that a verified token is not decoded again
+        """
+        payload = {'item1': 'value1', 'exp': int(time.time()) + 60}
+        jwt_string = make_jwt(key='secret', **payload)
+
+        assert JWT(jwt_string, ['secret']).payload == payload
+        with mock.patch('jwt_auth.jwt.parse') as parse:
+            assert JWT(jwt_string, ['secret']).payload == payload
+
+        parse.assert_not_called()
+        assert TOKEN_CACHE.hits == 1
+
+    @staticmethod
+    @override_settings(JWT_AUTH={'TOKEN_CACHE_SIZE': 10})
+    def test_expired(make_jwt):
+        """Test that a cached payload is not returned after exp
+        """
+        payload = {'item1': 'value1', 'exp': int(time.time()) + 60}
+        jwt_string = make_jwt(key='secret', **payload)
+        JWT(jwt_string, ['secret']).payload
+
+        with mock.patch('jwt_auth.cache.time.time') as now, \
+                mock.patch('jwt_auth.jwt.parse', wraps=parse) as parse_mock:
+            now.return_value = payload['exp']
+            JWT(jwt_string, ['secret']).payload
+
+        parse_mock.assert_called_once()
+        assert TOKEN_CACHE.hits == 0
+
+    @staticmethod
+    @override_settings(JWT_AUTH={'TOKEN_CACHE_SIZE': 10})
+    def test_other_keys(make_jwt):
+        """Test that a payload is not returned when verifying with other keys
+        """
+        jwt_string = make_jwt(key='secret', item1='value1')
+        JWT(jwt_string, ['secret']).payload
+
+        with pytest.raises(jwt.InvalidSignatureError):
+            JWT(jwt_string, ['wrong']).payload
+        result, = verify_many([jwt_string], keys=['wrong'])
+
+        assert isinstance(result, jwt.InvalidSignatureError)
+        assert TOKEN_CACHE.hits == 0
+
+    @staticmethod
+    @override_settings(JWT_AUTH={'TOKEN_CACHE_SIZE': 10})
+    def test_key_set_changed(make_jwt):
+        """Test that payloads are verified again once new keys are loaded
+        """
+        jwt_string = make_jwt(key='secret', item1='value1')
+        JWT(jwt_string, ['secret']).payload
+
+        with mock.patch.object(JWKS, 'generation', JWKS.generation + 1):
+            JWT(jwt_string, ['secret']).payload
+
+        assert TOKEN_CACHE.hits == 0
+
+    @staticmethod
+    def test_disabled(make_jwt):
+        """Test that payloads are not cached by default
+        """
+        jwt_string = make_jwt(key='secret', item1='value1')
+        JWT(jwt_string, ['secret']).payload
+
+        assert len(TOKEN_CACHE) == 0
+
+
+class TestNamedKeys:
+    """Test tokens verified with keys named by kid
+    """
+
+    @staticmethod
+    def test_kid():
+        """Test that only the key named by the kid is used
+        """
+        payload = {'item1': 'value1'}
+        jwt_string = jwt.encode(
+            payload, 'secret2', 'HS256', headers={'kid': 'key2'},
+        ).decode()
+        keys = {'key1': 'secret1', 'key2': 'secret2'}
+
+        with mock.patch(
+            'jwt_auth.jwt.JWT._check_signature',
+            wraps=JWT._check_signature,
+        ) as check_signature:
+            assert JWT(jwt_string, keys).payload == payload
+
+        assert check_signature.call_args[0][1] == ['secret2']
+
+    @staticmethod
+    def test_unknown_kid():
+        """Test that a token with an unknown kid is rejected
+        """
+        jwt_string = jwt.encode(
+            {'item1': 'value1'}, 'secret2', 'HS256', headers={'kid': 'other'},
+        ).decode()
+
+        with pytest.raises(ValueError):
+            JWT(jwt_string, {'key1': 'secret1', 'key2': 'secret2'}).payload
+
+    @staticmethod
+    def test_no_kid(make_jwt):
+        """Test that the token is only parsed once without a kid
+        """
+        payload = {'item1': 'value1'}
+        jwt_string = make_jwt(key='secret3', **payload)
+        keys = {'key1': 'secret1', 'key2': 'secret2', 'key3': 'secret3'}
+
+        with mock.patch('jwt_auth.jwt.parse', wraps=parse) as parse_mock:
+            assert JWT(jwt_string, keys).payload == payload
+
+        parse_mock.assert_called_once()
+
+    @staticmethod
+    def test_no_kid_bad_key(make_jwt):
+        """Test that a token signed with an unknown key is rejected
+        """
+        jwt_string = make_jwt(key='not a good key', item1='value1')
+
+        with mock.patch('jwt_auth.jwt.decode_payload') as decode_payload:
+            with pytest.raises(jwt.InvalidSignatureError):
+                JWT(jwt_string, {'key1': 'secret1', 'key2': 'secret2'}).payload
+
+        decode_payload.assert_not_called()
+
+
+class TestClaims:
+    """Test the validation of the registered claims
+    """
+
+    @staticmethod
+    def test_expired(make_jwt):
+        """Test that an expired token is rejected
+        """
+        jwt_string = make_jwt(key='secret', exp=int(time.time()) - 1)
+
+        with pytest.raises(jwt.ExpiredSignatureError):
+            JWT(jwt_string, ['secret']).payload
+
+    @staticmethod
+    def test_not_yet_valid(make_jwt):
+        """Test that a token used before its nbf is rejected
+        """
+        jwt_string = make_jwt(key='secret', nbf=int(time.time()) + 60)
+
+        with pytest.raises(jwt.ImmatureSignatureError):
+            JWT(jwt_string, ['secret']).payload
+
+    @staticmethod
+    def test_audience(make_jwt):
+        """Test that the aud claim is only rejected when VERIFY_AUD is set
+        """
+        jwt_string = make_jwt(key='secret', aud='service')
+
+        with override_settings(JWT_AUTH={'VERIFY_AUD': True}):
+            with pytest.raises(jwt.InvalidAudienceError):
+                JWT(jwt_string, ['secret']).payload
+        with override_settings(JWT_AUTH={'VERIFY_AUD': False}):
+            assert JWT(jwt_string, ['secret']).payload == {'aud': 'service'}
+
+    @staticmethod
+    def test_malformed():
+        """Test that a malformed token is rejected
+        """
+        with pytest.raises(jwt.DecodeError):
+            JWT('not a token', ['secret']).payload
+        with pytest.raises(jwt.DecodeError):
+            JWT('bm90.e30.c2ln', ['secret']).payload
+
+
+class TestVerifyMany:
+    """Test the verify_many function
+    """
+
+    @staticmethod
+    def test_order(make_jwt):
+        """Test that payloads and errors are returned in input order
+        """
+        first = make_jwt(key='secret', item='first')
+        second = make_jwt(key='secret', item='second')
+        bad_key = make_jwt(key='other', item='bad')
+
+        results = verify_many(
+            [first, 'not a token', second, bad_key, first], ['secret'],
+        )
+
+        assert results[0] == {'item': 'first'}
+        assert isinstance(results[1], jwt.DecodeError)
+        assert results[2] == {'item': 'second'}
+        assert isinstance(results[3], jwt.InvalidSignatureError)
+        assert results[4] is results[0]
+
+    @staticmethod
+    def test_malformed_header(make_jwt):
+        """Test that a kid or alg that is not a string only fails its token
+        """
+        token = make_jwt(key='secret', item='value')
+        header = base64url_encode(json.dumps({
+            'alg': 'HS256', 'kid': ['a', 'b'],
+        }).encode()).decode()
+        malformed = '.'.join([header] + token.split('.')[1:])
+
+        results = verify_many([token, malformed], ['secret'])
+
+        assert results[0] == {'item': 'value'}
+        assert isinstance(results[1], jwt.InvalidTokenError)
+
+    @staticmethod
+    def test_deduplicated(make_jwt):
+        """Test that identical tokens are verified once
+        """
+        token = make_jwt(key='secret', item='value')
+
+        with mock.patch(
+            'jwt_auth.jwt.JWT._check_signature',
+            wraps=JWT._check_signature,
+        ) as check_signature:
+            results = verify_many([token, token.encode(), token], ['secret'])
+
+        assert results == [{'item': 'value'}] * 3
+        check_signature.assert_called_once()
+
+    @staticmethod
+    def test_rs256(private_key):
+        """Test that RS256 tokens are verified on the thread pool
+        """
+        tokens = [
+            jwt.encode(
+                {'item': index}, private_key, 'RS256',
+                headers={'kid': TEST_KID},
+            ).decode()
+            for index in range(8)
+        ]
+
+        with mock.patch.object(
+            JWKS, 'get_jwk', return_value=private_key.public_key(),
+        ), mock.patch('jwt_auth.jwt.os.cpu_count', return_value=4):
+            results = verify_many(tokens, ['secret'])
+
+        assert results == [{'item': index} for index in range(8)]
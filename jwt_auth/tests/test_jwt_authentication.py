@@ -1,12 +1,26 @@
 """Tests for the JWTAuthentication class
 """
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
 import pytest
+import requests
+import responses
 
 from django.http import HttpRequest
+from django.test import override_settings
 
 from rest_framework.exceptions import AuthenticationFailed
 
-from jwt_auth.authentication import JWTAuthentication
+from jwt_auth.authentication import (
+    AUTHORIZATION_CACHE, PERMISSION_CIRCUIT, JWTAuthentication,
+)
+from jwt_auth.circuit_breaker import OPEN, CircuitOpenError
+from jwt_auth.tests.fixtures import *  # noqa
 
 
 class TestAuthenticate:
@@ -68,3 +82,635 @@ class TestAuthenticateHeader:
         expected = 'aps.example.com/user/accounts/login/'
         actual = JWTAuthentication().authenticate_header(request)
         assert actual == expected
+
+
+class TestGetAuthorization:
+    """Tests for the JWTAuthentication._get_authorization function
+    """
+
+    @staticmethod
+    def setup_method():
+        AUTHORIZATION_CACHE.clear()
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+    })
+    def test_not_cached(make_authorization_data):
+        """Test that the authorization is fetched for every call by default
+        """
+        data = make_authorization_data()
+        responses.add(responses.GET, 'http://test.com', json=data)
+        user_id = uuid4()
+
+        assert JWTAuthentication._get_authorization(user_id) == data
+        assert JWTAuthentication._get_authorization(user_id) == data
+
+        assert len(responses.calls) == 2
+        assert responses.calls[0].request.params == {'uuid': str(user_id)}
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+        'AUTHORIZATION_CACHE_TTL': 60,
+    })
+    def test_cached(make_authorization_data):
+        """Test that the authorization is cached for repeat users
+        """
+        data = make_authorization_data()
+        responses.add(responses.GET, 'http://test.com', json=data)
+        user_id = uuid4()
+
+        assert JWTAuthentication._get_authorization(user_id) == data
+        assert JWTAuthentication._get_authorization(user_id) == data
+
+        assert len(responses.calls) == 1
+        assert AUTHORIZATION_CACHE.hits == 1
+        assert AUTHORIZATION_CACHE.misses == 1
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+        'AUTHORIZATION_CACHE_TTL': 60,
+    })
+    def test_expired(make_authorization_data):
+        """Test that the authorization is fetched again after the TTL
+        """
+        data = make_authorization_data()
+        responses.add(responses.GET, 'http://test.com', json=data)
+        user_id = uuid4()
+        JWTAuthentication._get_authorization(user_id)
+        later = time.time() + 60
+
+        with mock.patch('jwt_auth.cache.time.time') as now:
+            now.return_value = later
+            JWTAuthentication._get_authorization(user_id)
+
+        assert len(responses.calls) == 2
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+    })
+    def test_concurrent(make_authorization_data):
+        """Test that concurrent lookups of a user share one request
+        """
+        data = make_authorization_data()
+
+        def slow_authorization(request):
+            time.sleep(0.1)
+            return 200, {}, json.dumps(data)
+
+        responses.add_callback(
+            responses.GET, 'http://test.com', callback=slow_authorization,
+        )
+        user_id = uuid4()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(
+                lambda _: JWTAuthentication._get_authorization(user_id),
+                range(8),
+            ))
+
+        assert len(responses.calls) == 1
+        assert all(result == data for result in results)
+
+
+def _bulk_authorization(data):
+    """Make a bulk endpoint callback answering for the requested uuids."""
+    def callback(request):
+        uuids = parse_qs(urlparse(request.url).query)['uuid']
+        return 200, {}, json.dumps({uuid: data for uuid in uuids})
+    return callback
+
+
+class TestEndpointFailures:
+    """Tests for the handling of permission endpoint failures
+    """
+
+    @staticmethod
+    def setup_method():
+        AUTHORIZATION_CACHE.clear()
+        PERMISSION_CIRCUIT.reset()
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+        'HTTP_RETRIES': 0,
+        'AUTHORIZATION_CACHE_TTL': 60,
+        'AUTHORIZATION_CACHE_STALE_TTL': 300,
+    })
+    def test_stale(make_authorization_data):
+        """Test that expired data is served while the endpoint fails
+        """
+        data = make_authorization_data()
+        responses.add(responses.GET, 'http://test.com', json=data)
+        responses.add(responses.GET, 'http://test.com', status=503)
+        user_id = uuid4()
+        JWTAuthentication._get_authorization(user_id)
+        later = time.time() + 120
+
+        with mock.patch('jwt_auth.cache.time.time') as now:
+            now.return_value = later
+            assert JWTAuthentication._get_authorization(user_id) == data
+            now.return_value = later + 300
+            with pytest.raises(requests.HTTPError):
+                JWTAuthentication._get_authorization(user_id)
+
+        assert len(responses.calls) == 3
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+        'HTTP_RETRIES': 0,
+        'AUTHORIZATION_CACHE_TTL': 60,
+        'AUTHORIZATION_CACHE_STALE_TTL': 300,
+    })
+    def test_stale_not_served_for_client_errors(make_authorization_data):
+        """Test that expired data is not served once the user is unknown
+        """
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_authorization_data(),
+        )
+        responses.add(responses.GET, 'http://test.com', status=404)
+        user_id = uuid4()
+        JWTAuthentication._get_authorization(user_id)
+        later = time.time() + 120
+
+        with mock.patch('jwt_auth.cache.time.time') as now:
+            now.return_value = later
+            with pytest.raises(requests.HTTPError):
+                JWTAuthentication._get_authorization(user_id)
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+        'HTTP_RETRIES': 0,
+        'PERMISSION_CIRCUIT_FAILURES': 2,
+    })
+    def test_circuit_open():
+        """Test that the endpoint is not called once the circuit is open
+        """
+        responses.add(responses.GET, 'http://test.com', status=503)
+
+        for _ in range(2):
+            with pytest.raises(requests.HTTPError):
+                JWTAuthentication._get_authorization(uuid4())
+        with pytest.raises(CircuitOpenError):
+            JWTAuthentication._get_authorization(uuid4())
+
+        assert PERMISSION_CIRCUIT.state == OPEN
+        assert len(responses.calls) == 2
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+        'HTTP_RETRIES': 0,
+        'PERMISSION_CIRCUIT_FAILURES': 1,
+    })
+    def test_client_errors():
+        """Test that client errors do not open the circuit
+        """
+        responses.add(responses.GET, 'http://test.com', status=404)
+
+        for _ in range(2):
+            with pytest.raises(requests.HTTPError):
+                JWTAuthentication._get_authorization(uuid4())
+
+        assert len(responses.calls) == 2
+
+
+class TestGetAuthorizations:
+    """Tests for the JWTAuthentication.get_authorizations function
+    """
+
+    @staticmethod
+    def setup_method():
+        AUTHORIZATION_CACHE.clear()
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_BULK_ENDPOINT': 'http://test.com/bulk',
+        'PERMISSION_BULK_SIZE': 2,
+        'SERVICE_SECRET_TOKEN': 'super secret',
+    })
+    def test_chunks(make_authorization_data):
+        """Test that the users are fetched in chunks of the bulk size
+        """
+        data = make_authorization_data()
+        responses.add_callback(
+            responses.GET, 'http://test.com/bulk',
+            callback=_bulk_authorization(data),
+        )
+        user_ids = [uuid4() for _ in range(5)]
+
+        actual = JWTAuthentication.get_authorizations(user_ids + user_ids[:1])
+
+        assert actual == {str(user_id): data for user_id in user_ids}
+        assert len(responses.calls) == 3
+        assert responses.calls[0].request.headers['Token'] == 'super secret'
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_BULK_ENDPOINT': 'http://test.com/bulk',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+    })
+    def test_unknown_user(make_authorization_data):
+        """Test that users unknown to the bulk endpoint are left out
+        """
+        known = str(uuid4())
+        responses.add(
+            responses.GET, 'http://test.com/bulk',
+            json={known: make_authorization_data()},
+        )
+
+        actual = JWTAuthentication.get_authorizations([known, uuid4()])
+
+        assert list(actual) == [known]
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'PERMISSION_BULK_ENDPOINT': 'http://test.com/bulk',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+        'AUTHORIZATION_CACHE_TTL': 60,
+    })
+    def test_cached(make_authorization_data):
+        """Test that the fetched users are cached
+        """
+        data = make_authorization_data()
+        responses.add_callback(
+            responses.GET, 'http://test.com/bulk',
+            callback=_bulk_authorization(data),
+        )
+        user_ids = [uuid4(), uuid4()]
+        JWTAuthentication.get_authorizations(user_ids[:1])
+
+        actual = JWTAuthentication.get_authorizations(user_ids)
+
+        assert len(actual) == 2
+        assert JWTAuthentication._get_authorization(user_ids[1]) == data
+        assert len(responses.calls) == 2
+        query = parse_qs(urlparse(responses.calls[1].request.url).query)
+        assert query == {'uuid': [str(user_ids[1])]}
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+    })
+    def test_no_bulk_endpoint(make_authorization_data):
+        """Test that users are fetched one by one without a bulk endpoint
+        """
+        data = make_authorization_data()
+        responses.add(responses.GET, 'http://test.com', json=data)
+        user_ids = [uuid4(), uuid4()]
+
+        actual = JWTAuthentication.get_authorizations(user_ids)
+
+        assert actual == {str(user_id): data for user_id in user_ids}
+        assert len(responses.calls) == 2
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+        'HTTP_RETRIES': 0,
+    })
+    def test_unknown_user_no_bulk_endpoint(make_authorization_data):
+        """Test that a user the endpoint does not know is only left out
+        """
+        data = make_authorization_data()
+        unknown = uuid4()
+
+        def callback(request):
+            uuid = parse_qs(urlparse(request.url).query)['uuid'][0]
+            if uuid == str(unknown):
+                return 404, {}, json.dumps({'detail': 'Not found.'})
+            return 200, {}, json.dumps(data)
+
+        responses.add_callback(
+            responses.GET, 'http://test.com', callback=callback,
+        )
+        user_ids = [uuid4(), unknown, uuid4()]
+
+        actual = JWTAuthentication.get_authorizations(user_ids)
+
+        assert actual == {
+            str(user_ids[0]): data,
+            str(user_ids[2]): data,
+        }
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_BULK_ENDPOINT': 'http://test.com/bulk',
+        'PERMISSION_BULK_SIZE': 1,
+        'SERVICE_SECRET_TOKEN': 'super secret',
+        'HTTP_RETRIES': 0,
+    })
+    def test_chunk_error(make_authorization_data):
+        """Test that a failed chunk only leaves out its own users
+        """
+        data = make_authorization_data()
+        responses.add(responses.GET, 'http://test.com/bulk', status=500)
+        responses.add_callback(
+            responses.GET, 'http://test.com/bulk',
+            callback=_bulk_authorization(data),
+        )
+        user_ids = [uuid4(), uuid4()]
+
+        actual = JWTAuthentication.get_authorizations(user_ids)
+
+        assert actual == {str(user_ids[1]): data}
+
+
+class TestBatchedAuthorization:
+    """Tests for batching concurrent authorization lookups
+    """
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'PERMISSION_BULK_ENDPOINT': 'http://test.com/bulk',
+        'PERMISSION_BATCH_WINDOW': 0.05,
+        'SERVICE_SECRET_TOKEN': 'super secret',
+    })
+    def test_batched(make_authorization_data):
+        """Test that lookups of different users share one bulk request
+        """
+        data = make_authorization_data()
+        responses.add_callback(
+            responses.GET, 'http://test.com/bulk',
+            callback=_bulk_authorization(data),
+        )
+        user_ids = [uuid4() for _ in range(4)]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(
+                JWTAuthentication._get_authorization, user_ids,
+            ))
+
+        assert all(result == data for result in results)
+        assert len(responses.calls) == 1
+        query = parse_qs(urlparse(responses.calls[0].request.url).query)
+        assert sorted(query['uuid']) == sorted(map(str, user_ids))
+
+
+class TestAuthenticateTokens:
+    """Tests for the JWTAuthentication.authenticate_tokens function
+    """
+
+    @staticmethod
+    def setup_method():
+        AUTHORIZATION_CACHE.clear()
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'KEYS': ['test-key'],
+        'PERMISSION_BULK_ENDPOINT': 'http://test.com/bulk',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+    })
+    def test_authenticate(make_jwt, make_authorization_data):
+        """Test that each token gets its user or an error, in order
+        """
+        responses.add_callback(
+            responses.GET, 'http://test.com/bulk',
+            callback=_bulk_authorization(make_authorization_data()),
+        )
+        user_ids = [uuid4(), uuid4()]
+        tokens = [
+            make_jwt(uuid=str(user_ids[0]), email='first@example.com'),
+            'not a token',
+            make_jwt(uuid=str(user_ids[1]), email='second@example.com'),
+        ]
+
+        first, invalid, second = JWTAuthentication.authenticate_tokens(tokens)
+
+        assert first.id == user_ids[0]
+        assert first.is_staff
+        assert isinstance(invalid, AuthenticationFailed)
+        assert second.email == 'second@example.com'
+        assert len(responses.calls) == 1
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'KEYS': ['test-key'],
+        'PERMISSION_BULK_ENDPOINT': 'http://test.com/bulk',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+    })
+    def test_endpoint_error(make_jwt):
+        """Test that every token fails when the bulk endpoint fails
+        """
+        responses.add(responses.GET, 'http://test.com/bulk', status=500)
+        token = make_jwt(uuid=str(uuid4()), email='user@example.com')
+
+        results = JWTAuthentication.authenticate_tokens([token, token])
+
+        assert all(isinstance(result, AuthenticationFailed)
+                   for result in results)
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'KEYS': ['test-key'],
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'SERVICE_SECRET_TOKEN': 'super secret',
+        'HTTP_RETRIES': 0,
+    })
+    def test_unknown_user(make_jwt, make_authorization_data):
+        """Test that a user the endpoint does not know only fails its token
+        """
+        data = make_authorization_data()
+        unknown = uuid4()
+
+        def callback(request):
+            uuid = parse_qs(urlparse(request.url).query)['uuid'][0]
+            if uuid == str(unknown):
+                return 404, {}, json.dumps({'detail': 'Not found.'})
+            return 200, {}, json.dumps(data)
+
+        responses.add_callback(
+            responses.GET, 'http://test.com', callback=callback,
+        )
+        tokens = [
+            make_jwt(uuid=str(uuid4()), email='first@example.com'),
+            make_jwt(uuid=str(unknown), email='unknown@example.com'),
+            make_jwt(uuid=str(uuid4()), email='second@example.com'),
+        ]
+
+        first, failed, second = JWTAuthentication.authenticate_tokens(tokens)
+
+        assert first.email == 'first@example.com'
+        assert isinstance(failed, AuthenticationFailed)
+        assert second.email == 'second@example.com'
+
+
+class TestAuthorizationClaim:
+    """Test the authorization data embedded in tokens
+    """
+
+    @staticmethod
+    def setup_method():
+        AUTHORIZATION_CACHE.clear()
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'KEYS': ['test-key'],
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'AUTHORIZATION_CLAIM': 'authorization',
+    })
+    def test_claim_used(make_jwt, make_authorization_data):
+        """Test that the user is built from the token without any request
+        """
+        authorization = make_authorization_data()
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = 'JWT ' + make_jwt(
+            uuid=str(uuid4()),
+            email='user@example.com',
+            iat=int(time.time()),
+            authorization=authorization,
+        )
+
+        user, _ = JWTAuthentication().authenticate(request)
+
+        assert user.is_staff
+        assert list(user.groups) == authorization['role']['groups']
+        assert len(responses.calls) == 0
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'KEYS': ['test-key'],
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'AUTHORIZATION_CLAIM': 'authorization',
+    })
+    def test_invalid_uuid(make_jwt, make_authorization_data):
+        """Test that the uuid is validated when the claim is used
+        """
+        token = make_jwt(
+            uuid='not-a-uuid',
+            email='user@example.com',
+            iat=int(time.time()),
+            authorization=make_authorization_data(),
+        )
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = 'JWT ' + token
+
+        with pytest.raises(AuthenticationFailed):
+            JWTAuthentication().authenticate(request)
+        result, = JWTAuthentication.authenticate_tokens([token])
+
+        assert isinstance(result, AuthenticationFailed)
+        assert len(responses.calls) == 0
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'KEYS': ['test-key'],
+        'PERMISSION_ENDPOINT': 'http://test.com',
+        'AUTHORIZATION_CLAIM': 'authorization',
+        'AUTHORIZATION_CLAIM_MAX_AGE': 60,
+    })
+    def test_stale_claim(make_jwt, make_authorization_data):
+        """Test that the endpoint is called when the token is too old
+        """
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_authorization_data(),
+        )
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = 'JWT ' + make_jwt(
+            uuid=str(uuid4()),
+            email='user@example.com',
+            iat=int(time.time()) - 120,
+            authorization=make_authorization_data(is_active=False),
+        )
+
+        user, _ = JWTAuthentication().authenticate(request)
+
+        assert user.is_active
+        assert len(responses.calls) == 1
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'KEYS': ['test-key'],
+        'PERMISSION_ENDPOINT': 'http://test.com',
+    })
+    def test_disabled(make_jwt, make_authorization_data):
+        """Test that the claim is ignored unless it is enabled
+        """
+        responses.add(
+            responses.GET, 'http://test.com',
+            json=make_authorization_data(),
+        )
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = 'JWT ' + make_jwt(
+            uuid=str(uuid4()),
+            email='user@example.com',
+            iat=int(time.time()),
+            authorization=make_authorization_data(),
+        )
+
+        JWTAuthentication().authenticate(request)
+
+        assert len(responses.calls) == 1
+
+    @staticmethod
+    @responses.activate
+    @override_settings(JWT_AUTH={
+        'KEYS': ['test-key'],
+        'PERMISSION_BULK_ENDPOINT': 'http://test.com/bulk',
+        'AUTHORIZATION_CLAIM': 'authorization',
+    })
+    def test_authenticate_tokens(make_jwt, make_authorization_data):
+        """Test that only the users without the claim are fetched
+        """
+        responses.add_callback(
+            responses.GET, 'http://test.com/bulk',
+            callback=_bulk_authorization(make_authorization_data()),
+        )
+        embedded, fetched = uuid4(), uuid4()
+        tokens = [
+            make_jwt(
+                uuid=str(embedded),
+                email='first@example.com',
+                iat=int(time.time()),
+                authorization=make_authorization_data(),
+            ),
+            make_jwt(uuid=str(fetched), email='second@example.com'),
+        ]
+
+        first, second = JWTAuthentication.authenticate_tokens(tokens)
+
+        assert first.is_staff
+        assert second.is_staff
+        query = parse_qs(urlparse(responses.calls[0].request.url).query)
+        assert query['uuid'] == [str(fetched)]
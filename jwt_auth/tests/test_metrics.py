@@ -0,0 +1,103 @@
+"""Tests for the instrumentation of the authentication path
+"""
+import pytest
+from django.http import HttpRequest
+from django.test import override_settings
+
+from jwt_auth import metrics
+from jwt_auth.jwt import JWT, TOKEN_CACHE
+from jwt_auth.metrics import InMemoryCollector
+from jwt_auth.tests.fixtures import *  # noqa
+from jwt_auth.views import metrics_view
+
+
+@pytest.fixture
+def collector():
+    """An in-memory collector, set as the current one during the test."""
+    collector = InMemoryCollector()
+    metrics.set_collector(collector)
+    yield collector
+    metrics.set_collector(metrics.NULL_COLLECTOR)
+
+
+class TestInMemoryCollector:
+    """Test the InMemoryCollector class
+    """
+
+    @staticmethod
+    def test_prometheus():
+        """Test that the metrics are rendered for Prometheus
+        """
+        collector = InMemoryCollector()
+        collector.increment('token_cache_hits_total')
+        collector.increment('token_cache_hits_total', 2)
+        collector.observe('token_parse_seconds', 0.0002)
+        collector.observe('token_parse_seconds', 20)
+
+        lines = collector.to_prometheus().splitlines()
+
+        assert 'jwt_auth_token_cache_hits_total 3' in lines
+        assert 'jwt_auth_token_parse_seconds_bucket{le="0.0001"} 0' in lines
+        assert 'jwt_auth_token_parse_seconds_bucket{le="0.00025"} 1' in lines
+        assert 'jwt_auth_token_parse_seconds_bucket{le="10.0"} 1' in lines
+        assert 'jwt_auth_token_parse_seconds_bucket{le="+Inf"} 2' in lines
+        assert 'jwt_auth_token_parse_seconds_count 2' in lines
+
+    @staticmethod
+    def test_discarded():
+        """Test that nothing is timed by default
+        """
+        assert metrics.get_collector() is metrics.NULL_COLLECTOR
+        assert metrics.timer('token_parse_seconds') is metrics._NULL_TIMER
+
+
+class TestInstrumentation:
+    """Test the metrics reported on the authentication path
+    """
+
+    @staticmethod
+    def setup_method():
+        TOKEN_CACHE.clear()
+
+    @staticmethod
+    @override_settings(JWT_AUTH={'TOKEN_CACHE_SIZE': 10})
+    def test_token(collector, make_jwt):
+        """Test that token verification is instrumented
+        """
+        jwt_string = make_jwt(key='secret', item1='value1')
+
+        JWT(jwt_string, ['secret']).payload
+        JWT(jwt_string, ['secret']).payload
+
+        assert collector.counters == {
+            'token_cache_hits_total': 1,
+            'token_cache_misses_total': 1,
+        }
+        assert collector.histograms['token_parse_seconds'].count == 1
+        assert collector.histograms['key_lookup_seconds'].count == 1
+        assert collector.histograms[
+            'signature_verification_seconds'
+        ].count == 1
+
+
+class TestMetricsView:
+    """Test the metrics_view function
+    """
+
+    @staticmethod
+    def test_not_kept():
+        """Test that nothing is exported when the metrics are discarded
+        """
+        assert metrics_view(HttpRequest()).status_code == 404
+
+    @staticmethod
+    def test_exported(collector):
+        """Test that the kept metrics are exported
+        """
+        collector.increment('jwks_refreshes_total')
+
+        response = metrics_view(HttpRequest())
+
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain')
+        assert b'jwt_auth_jwks_refreshes_total 1' in response.content
@@ -0,0 +1,72 @@
+"""Tests for the group based permission classes
+"""
+from types import SimpleNamespace
+from uuid import uuid4
+
+from django.http import HttpRequest
+
+from jwt_auth.models import User
+from jwt_auth.permissions import all_groups, any_group
+from jwt_auth.tests.fixtures import *  # noqa
+
+
+def make_request(user) -> HttpRequest:
+    """Make a request authenticated as the given user."""
+    request = HttpRequest()
+    request.user = user
+    return request
+
+
+def make_user(make_authorization_data, groups: list) -> User:
+    """Make a user who belongs to the given groups."""
+    user = User(str(uuid4()), 'user@example.com')
+    user.set_authorization(make_authorization_data(role={
+        'is_staff': False,
+        'is_superuser': False,
+        'groups': groups,
+    }))
+    return user
+
+
+class TestAnyGroup:
+    """Tests for the any_group permission classes
+    """
+
+    @staticmethod
+    def test_has_permission(make_authorization_data):
+        """Test that users in any of the groups are allowed
+        """
+        permission = any_group('Admin', 'Writer')()
+
+        writer = make_user(make_authorization_data, ['Writer'])
+        reader = make_user(make_authorization_data, ['Reader'])
+
+        assert permission.has_permission(make_request(writer), None)
+        assert not permission.has_permission(make_request(reader), None)
+
+    @staticmethod
+    def test_anonymous():
+        """Test that users without groups, e.g. anonymous users, are not
+        allowed
+        """
+        permission = any_group('Admin')()
+        anonymous = SimpleNamespace(is_authenticated=False)
+
+        assert not permission.has_permission(make_request(anonymous), None)
+
+
+class TestAllGroups:
+    """Tests for the all_groups permission classes
+    """
+
+    @staticmethod
+    def test_has_permission(make_authorization_data):
+        """Test that only users in all the groups are allowed
+        """
+        permission = all_groups('Admin', 'Writer')()
+
+        admin = make_user(make_authorization_data, ['Admin', 'Writer'])
+        writer = make_user(make_authorization_data, ['Writer'])
+
+        assert permission.has_permission(make_request(admin), None)
+        assert not permission.has_permission(make_request(writer), None)
@@ -0,0 +1,54 @@
+"""Tests for the shared HTTP session
+"""
+import pytest
+import responses
+from django.test import override_settings
+
+from jwt_auth.session import get_session, reset_session
+
+
+@pytest.fixture(autouse=True)
+def new_session():
+    """Make sure each test uses a new session."""
+    reset_session()
+    yield
+    reset_session()
+
+
+class TestGetSession:
+    """Tests for the get_session function
+    """
+
+    @staticmethod
+    def test_shared():
+        """Test that the same session is returned
+        """
+        assert get_session() is get_session()
+
+    @staticmethod
+    @override_settings(JWT_AUTH={
+        'HTTP_POOL_SIZE': 32,
+        'HTTP_RETRIES': 3,
+        'HTTP_BACKOFF_FACTOR': 0.5,
+    })
+    def test_settings():
+        """Test that the pool and retries are configured from the settings
+        """
+        adapter = get_session().get_adapter('https://test.com')
+
+        assert adapter._pool_maxsize == 32
+        assert adapter.max_retries.total == 3
+        assert adapter.max_retries.backoff_factor == 0.5
+
+    @staticmethod
+    @responses.activate
+    def test_no_cookies():
+        """Test that cookies are not kept between requests
+        """
+        responses.add(
+            responses.GET, 'http://test.com',
+            headers={'Set-Cookie': 'session=secret'},
+        )
+        get_session().get('http://test.com')
+
+        assert not get_session().cookies
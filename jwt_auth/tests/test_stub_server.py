@@ -0,0 +1,104 @@
+"""Tests for the stub JWKS and permission server
+"""
+import time
+from unittest import mock
+from uuid import uuid4
+
+import pytest
+import requests
+from django.test import override_settings
+
+from jwt_auth.jwks import Jwks
+from jwt_auth.jwt import JWT
+from jwt_auth.stub_server import DEFAULT_AUTHORIZATION, StubServer
+from jwt_auth.tests.fixtures import *  # noqa
+
+
+@pytest.fixture
+def stub():
+    """A running stub server."""
+    with StubServer(service_token='stub token') as server:
+        yield server
+
+
+class TestStubServer:
+    """Test the StubServer class
+    """
+
+    @staticmethod
+    def test_tokens(stub):
+        """Test that the signed tokens verify with the served key set
+        """
+        token = stub.sign({'uuid': 'user', 'email': 'user@example.com'})
+
+        with override_settings(JWT_AUTH={
+            'KEYS': ['unused'],
+            'JWKS_ENDPOINT': stub.url + '/jwks',
+        }), mock.patch('jwt_auth.jwt.JWKS', Jwks()):
+            payload = JWT(token, ['unused']).payload
+
+        assert payload == {'uuid': 'user', 'email': 'user@example.com'}
+
+    @staticmethod
+    def test_permissions(stub):
+        """Test the permission endpoints
+        """
+        uuids = [str(uuid4()), str(uuid4())]
+        headers = {'Token': 'stub token'}
+
+        single = requests.get(
+            stub.url + '/permissions', params={'uuid': uuids[0]},
+            headers=headers,
+        )
+        bulk = requests.get(
+            stub.url + '/permissions/bulk', params={'uuid': uuids},
+            headers=headers,
+        )
+        unauthorized = requests.get(
+            stub.url + '/permissions', params={'uuid': uuids[0]},
+        )
+
+        assert single.json() == DEFAULT_AUTHORIZATION
+        assert bulk.json() == {uuid: DEFAULT_AUTHORIZATION for uuid in uuids}
+        assert unauthorized.status_code == 401
+        assert stub.requests['/permissions'] == 2
+
+    @staticmethod
+    def test_jwks_not_modified(stub):
+        """Test that an unchanged key set is revalidated with its ETag
+        """
+        response = requests.get(stub.url + '/jwks')
+        revalidated = requests.get(
+            stub.url + '/jwks',
+            headers={'If-None-Match': response.headers['ETag']},
+        )
+
+        assert response.headers['Cache-Control'] == 'max-age=300'
+        assert revalidated.status_code == 304
+
+    @staticmethod
+    def test_rotation():
+        """Test that keys are rotated on schedule, keeping the previous one
+        """
+        with StubServer(rotate_every=0.05) as stub:
+            first = stub.kid
+            time.sleep(0.05)
+            stub.sign()
+
+            kids = [jwk['kid'] for jwk in stub.jwks['keys']]
+
+        assert stub.kid != first
+        assert kids == [first, stub.kid]
+
+    @staticmethod
+    def test_errors_and_latency():
+        """Test that failures and latency are injected
+        """
+        with StubServer(error_rate=1, latency=0.05) as stub:
+            start = time.monotonic()
+            response = requests.get(stub.url + '/jwks')
+            elapsed = time.monotonic() - start
+
+        assert response.status_code == 503
+        assert stub.errors == 1
+        assert elapsed >= 0.05
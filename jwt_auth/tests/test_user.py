@@ -1,5 +1,7 @@
 """Tests the JWTAuthentication class
 """
+import copy
+from datetime import datetime, timezone
 from uuid import uuid4
 
 from jwt_auth.models import User
@@ -132,7 +134,7 @@ class TestSetAuthorization:
         # Test our expectations
         assert user.is_staff == role['is_staff']
         assert user.is_superuser == role['is_superuser']
-        assert user.groups == role['groups']
+        assert user.groups == tuple(role['groups'])
 
     @staticmethod
     def test_subscription(make_authorization_data):
@@ -210,11 +212,134 @@ class TestCheckSubscription:
         user.set_authorization(data)
 
         # invoke the function
-        actual = user.check_subscription('Test-Subscription1')
+        actual = user.check_subscription(
+            'Test-Subscription1',
+            now=datetime(2019, 5, 1, tzinfo=timezone.utc),
+        )
 
         # Test our expectations
         assert actual
 
+    @staticmethod
+    def test_expired(make_authorization_data):
+        """Test when the given subscription is active but has ended
+        """
+        user = User(str(uuid4()), 'test_user@example.com')
+        subscription = {
+            'plan': 'Test-Subscription1',
+            'status': 'active',
+            'start_date_time': '2019-01-03T17:41:42Z',
+            'end_date_time': '2019-09-03T16:41:42Z'
+        }
+        user.set_authorization(
+            make_authorization_data(subscription=subscription),
+        )
+
+        assert user.check_subscription('Test-Subscription1') is False
+        assert user.check_subscription(
+            'Test-Subscription1',
+            now=datetime(2019, 1, 1),
+        ) is False
+
+    @staticmethod
+    def test_naive_dates(make_authorization_data):
+        """Test that dates without a timezone are in UTC
+        """
+        user = User(str(uuid4()), 'test_user@example.com')
+        subscription = {
+            'plan': 'Test-Subscription1',
+            'status': 'active',
+            'start_date_time': '2019-01-03T17:41:42',
+            'end_date_time': '2019-09-03T16:41:42'
+        }
+        user.set_authorization(
+            make_authorization_data(subscription=subscription),
+        )
+
+        parsed, = user.subscriptions['Test-Subscription1']
+        assert parsed.end_date_time == datetime(
+            2019, 9, 3, 16, 41, 42, tzinfo=timezone.utc,
+        )
+        assert user.check_subscription(
+            'Test-Subscription1',
+            now=datetime(2019, 9, 3, 16, 41, 41),
+        )
+
+    @staticmethod
+    def test_invalid_dates(make_authorization_data):
+        """Test that empty or invalid dates are ignored
+        """
+        user = User(str(uuid4()), 'test_user@example.com')
+        subscription = {
+            'plan': 'Test-Subscription1',
+            'status': 'active',
+            'start_date_time': 'not a date',
+            'end_date_time': '',
+        }
+        user.set_authorization(
+            make_authorization_data(subscription=subscription),
+        )
+
+        parsed, = user.subscriptions['Test-Subscription1']
+        assert parsed.start_date_time is None
+        assert parsed.end_date_time is None
+        assert user.check_subscription('Test-Subscription1')
+
+    @staticmethod
+    def test_any_subscription(make_authorization_data):
+        """Test checking several plans at once
+        """
+        user = User(str(uuid4()), 'test_user@example.com')
+        subscriptions = [
+            {
+                'plan': 'monthly',
+                'status': 'inactive',
+                'start_date_time': '2019-01-03T17:41:42Z',
+                'end_date_time': '2019-09-03T16:41:42Z'
+            },
+            {
+                'plan': 'yearly',
+                'status': 'active',
+                'start_date_time': '2019-01-03T17:41:42Z',
+                'end_date_time': '2020-01-03T17:41:42Z'
+            },
+        ]
+        user.set_authorization(
+            make_authorization_data(subscription=subscriptions),
+        )
+        now = datetime(2019, 5, 1, tzinfo=timezone.utc)
+
+        assert user.check_any_subscription(['monthly', 'yearly'], now=now)
+        assert not user.check_any_subscription(['monthly', 'other'], now=now)
+        assert not user.check_any_subscription(['yearly'])
+
+    @staticmethod
+    def test_same_plan(make_authorization_data):
+        """Test that any active subscription of a plan is enough
+        """
+        user = User(str(uuid4()), 'test_user@example.com')
+        subscriptions = [
+            {
+                'plan': 'pro',
+                'status': 'active',
+                'start_date_time': '2019-01-03T17:41:42Z',
+                'end_date_time': '2099-01-03T17:41:42Z'
+            },
+            {
+                'plan': 'pro',
+                'status': 'canceled',
+                'start_date_time': '2019-01-03T17:41:42Z',
+                'end_date_time': '2020-01-03T17:41:42Z'
+            },
+        ]
+        user.set_authorization(
+            make_authorization_data(subscription=subscriptions),
+        )
+
+        assert user.check_subscription('pro')
+        assert user.check_any_subscription(['pro'])
+        assert len(user.subscriptions['pro']) == 2
+
     @staticmethod
     def test_does_not_exist(make_authorization_data):
         """Test when the given subscription does not exist
@@ -239,3 +364,93 @@ class TestCheckSubscription:
 
         # Test our expectations
         assert actual is False
+
+
+class TestSlots:
+    """Test the memory layout of User."""
+
+    @staticmethod
+    def test_no_dict():
+        """Test that users do not have a per-instance dict."""
+        user = User(str(uuid4()), 'user@example.com')
+
+        assert not hasattr(user, '__dict__')
+
+    @staticmethod
+    def test_lazy_uuid():
+        """Test that the uuid is only parsed when it is read."""
+        user = User('not a uuid', 'user@example.com')
+
+        with pytest.raises(ValueError):
+            user.uuid
+
+    @staticmethod
+    def test_authorization_shared(make_authorization_data):
+        """Test that the authorization data is not copied."""
+        user = User(str(uuid4()), 'user@example.com')
+        data = make_authorization_data()
+
+        user.set_authorization(data)
+
+        assert user.subscription is data['subscription']
+        assert data == make_authorization_data()
+
+    @staticmethod
+    def test_missing_property():
+        """Test that missing properties raise AttributeError."""
+        user = User(str(uuid4()), 'user@example.com')
+
+        assert getattr(user, 'is_staff', None) is None
+        with pytest.raises(AttributeError):
+            user.role
+
+    @staticmethod
+    def test_copy(make_authorization_data):
+        """Test that users can be copied."""
+        user = User(str(uuid4()), 'user@example.com', attribute1=1)
+        user.set_authorization(make_authorization_data())
+
+        other = copy.deepcopy(user)
+
+        assert other.uuid == user.uuid
+        assert other.attribute1 == 1
+        assert other.groups == user.groups
+
+
+class TestGroups:
+    """Test the User group checks."""
+
+    @staticmethod
+    def make_user(make_authorization_data) -> User:
+        user = User(str(uuid4()), 'user@example.com')
+        user.set_authorization(make_authorization_data())
+        return user
+
+    def test_has_group(self, make_authorization_data):
+        """Test checking a single group."""
+        user = self.make_user(make_authorization_data)
+
+        assert user.has_group('Admin')
+        assert not user.has_group('Reader')
+
+    def test_has_any_group(self, make_authorization_data):
+        """Test checking for any of several groups."""
+        user = self.make_user(make_authorization_data)
+
+        assert user.has_any_group('Reader', 'Writer')
+        assert not user.has_any_group('Reader', 'Service')
+
+    def test_has_all_groups(self, make_authorization_data):
+        """Test checking for all of several groups."""
+        user = self.make_user(make_authorization_data)
+
+        assert user.has_all_groups('Admin', 'Writer')
+        assert not user.has_all_groups('Admin', 'Reader')
+
+    @staticmethod
+    def test_service():
+        """Test that the service user belongs to the Service group."""
+        user = User(str(uuid4()), 'service@example.com')
+        user.set_service()
+
+        assert user.has_group('Service')
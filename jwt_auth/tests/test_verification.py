@@ -0,0 +1,149 @@
+"""Tests for the process verification engine
+"""
+import os
+import signal
+from unittest import mock
+
+import pytest
+from django.test import override_settings
+
+from jwt_auth.jwt import JWKS, JWT, PROCESS_VERIFIER, parse
+from jwt_auth.tests.fixtures import *  # noqa
+from jwt_auth.verification import ProcessVerifier
+
+
+@pytest.fixture
+def verifier():
+    """A verifier with a single process, stopped after the test."""
+    verifier = ProcessVerifier()
+    verifier.processes = 1
+    verifier.queue_size = 1
+    yield verifier
+    verifier.shutdown()
+
+
+class TestProcessVerifier:
+    """Test the ProcessVerifier class
+    """
+
+    @staticmethod
+    def test_verify(verifier, private_key):
+        """Test that signatures are checked with the pre-loaded keys
+        """
+        key_set = make_jwks(private_key)
+        token = parse(make_jws(private_key, 'value'))
+
+        assert verifier.verify(
+            key_set, TEST_KID, token.signing_input, token.signature,
+        ) is True
+        assert verifier.verify(
+            key_set, TEST_KID, token.signing_input + b'x', token.signature,
+        ) is False
+        assert verifier.verify(
+            key_set, 'unknown', token.signing_input, token.signature,
+        ) is None
+
+    @staticmethod
+    def test_queue_full(verifier, private_key):
+        """Test that nothing is verified once the queue is full
+        """
+        key_set = make_jwks(private_key)
+        token = parse(make_jws(private_key, 'value'))
+        _, slots = verifier._get_pool(key_set)
+        slots.acquire()
+
+        assert verifier.verify(
+            key_set, TEST_KID, token.signing_input, token.signature,
+        ) is None
+
+    @staticmethod
+    def test_key_rotation(verifier, private_key):
+        """Test that a new pool is started for a new key set
+        """
+        pool, _ = verifier._get_pool(make_jwks(private_key))
+
+        assert verifier._get_pool(make_jwks(private_key))[0] is not pool
+
+    @staticmethod
+    def test_worker_killed(verifier, private_key):
+        """Test that a new pool is started once a worker dies
+        """
+        key_set = make_jwks(private_key)
+        token = parse(make_jws(private_key, 'value'))
+        args = (key_set, TEST_KID, token.signing_input, token.signature)
+        assert verifier.verify(*args) is True
+        pool, _ = verifier._get_pool(key_set)
+
+        for process in list(pool._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+
+        with mock.patch('jwt_auth.verification.logger') as logger:
+            results = [verifier.verify(*args) for _ in range(3)]
+
+        assert results == [None, True, True]
+        assert verifier._get_pool(key_set)[0] is not pool
+        logger.exception.assert_not_called()
+        logger.warning.assert_called_once()
+
+    @staticmethod
+    def test_not_forked(verifier, private_key):
+        """Test that the workers are not forked from the server process
+        """
+        pool, _ = verifier._get_pool(make_jwks(private_key))
+
+        assert pool._mp_context.get_start_method() != 'fork'
+
+
+class TestProcessEngine:
+    """Test verifying tokens with VERIFICATION_ENGINE set to process
+    """
+
+    @staticmethod
+    def teardown_method():
+        PROCESS_VERIFIER.shutdown()
+
+    @staticmethod
+    @override_settings(JWT_AUTH={
+        'KEYS': ['secret'],
+        'VERIFICATION_ENGINE': 'process',
+        'VERIFICATION_PROCESSES': 1,
+    })
+    def test_payload(private_key):
+        """Test that RS256 signatures are checked in the pool
+        """
+        token = make_jws(private_key, 'value')
+
+        with mock.patch.object(
+            JWKS, 'get_jwk', return_value=private_key.public_key(),
+        ), mock.patch.object(
+            JWKS, '_jwks', make_jwks(private_key),
+        ), mock.patch(
+            'jwt_auth.jwt.JWT._check_signature',
+        ) as check_signature:
+            assert JWT(token, ['secret']).payload == {'value': 'value'}
+
+        check_signature.assert_not_called()
+
+    @staticmethod
+    @override_settings(JWT_AUTH={
+        'KEYS': ['secret'],
+        'VERIFICATION_ENGINE': 'process',
+        'VERIFICATION_QUEUE_SIZE': 1,
+    })
+    def test_fallback(private_key):
+        """Test that signatures are checked inline when the pool cannot
+        """
+        token = make_jws(private_key, 'value')
+
+        with mock.patch.object(
+            JWKS, 'get_jwk', return_value=private_key.public_key(),
+        ), mock.patch.object(
+            PROCESS_VERIFIER, 'verify', return_value=None,
+        ), mock.patch(
+            'jwt_auth.jwt.JWT._check_signature',
+            wraps=JWT._check_signature,
+        ) as check_signature:
+            assert JWT(token, ['secret']).payload == {'value': 'value'}
+
+        check_signature.assert_called_once()
@@ -0,0 +1,154 @@
+"""Offloads the verification of RS256 signatures to a pool of processes."""
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from jwt.algorithms import RSAAlgorithm
+
+from jwt_auth import metrics
+
+logger = logging.getLogger(__name__)
+
+_ALGORITHM = RSAAlgorithm(RSAAlgorithm.SHA256)
+
+# Forking a multithreaded server could deadlock the workers on locks held by
+# other threads, so they are started from a clean process instead.
+START_METHOD = (
+    'forkserver'
+    if 'forkserver' in multiprocessing.get_all_start_methods()
+    else 'spawn'
+)
+
+# Public keys loaded by a worker process, by kid.
+_worker_keys: dict = {}
+
+
+class ProcessVerifier:
+    """Verifies RS256 signatures in a pool of processes.
+
+    Each process loads the public keys of the key set once, when it starts,
+    and the pool is replaced when a new key set is loaded. At most
+    `queue_size` signatures are in flight; beyond that, and for keys the
+    pool does not know, `verify` returns None so the caller verifies the
+    signature itself.
+    """
+
+    def __init__(self):
+        self.processes = 0
+        self.queue_size = 0
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._key_set: Optional[dict] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def verify(
+            self,
+            key_set: Optional[dict],
+            kid: str,
+            signing_input: bytes,
+            signature: bytes,
+    ) -> Optional[bool]:
+        """Verify a signature in the pool.
+
+        Args:
+            key_set: The JSON Web Key Set the token's key belongs to.
+            kid: The kid of the key.
+            signing_input: The signed part of the token.
+            signature: The decoded signature.
+
+        Returns:
+            Whether the signature is valid, or None if it was not verified.
+        """
+        if key_set is None:
+            return None
+        pool, slots = self._get_pool(key_set)
+        if not slots.acquire(blocking=False):
+            logger.debug('Verification queue is full.')
+            metrics.increment('verification_queue_full_total')
+            return None
+        try:
+            return pool.submit(_verify, kid, signing_input, signature).result()
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            return None
+        except Exception:
+            logger.exception('Failed to verify the signature in the pool.')
+            return None
+        finally:
+            slots.release()
+
+    def shutdown(self) -> None:
+        """Stop the pool, a new one is started on the next verification."""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
+            self._key_set = None
+
+    def _discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Drop a pool whose worker died, a new one is started on the next
+        verification."""
+        with self._lock:
+            if self._pool is not pool:
+                # Already replaced by another thread.
+                return
+            self._pool = None
+            self._key_set = None
+        pool.shutdown(wait=False)
+        logger.warning('A verification process died, restarting the pool.')
+        metrics.increment('verification_pool_restarts_total')
+
+    def _get_pool(self, key_set: dict):
+        with self._lock:
+            # The pool does not survive a fork, so it is started again.
+            if self._pool is None or self._key_set is not key_set \
+                    or self._pid != os.getpid():
+                if self._pool is not None and self._pid == os.getpid():
+                    self._pool.shutdown(wait=False)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes or None,
+                    mp_context=multiprocessing.get_context(START_METHOD),
+                    initializer=_load_keys,
+                    initargs=(key_set,),
+                )
+                self._slots = threading.BoundedSemaphore(
+                    max(self.queue_size, 1),
+                )
+                self._key_set = key_set
+                self._pid = os.getpid()
+            return self._pool, self._slots
+
+
+def _load_keys(key_set: dict) -> None:
+    """Load the public keys of a worker process."""
+    global _worker_keys
+
+    keys = {}
+    for jwk in key_set.get('keys', []):
+        kid = jwk.get('kid')
+        if kid is None:
+            continue
+        try:
+            keys[kid] = RSAAlgorithm.from_jwk(json.dumps(jwk))
+        except Exception:
+            continue
+    _worker_keys = keys
+
+
+def _verify(
+        kid: str,
+        signing_input: bytes,
+        signature: bytes,
+) -> Optional[bool]:
+    """Verify a signature in a worker process."""
+    key = _worker_keys.get(kid)
+    if key is None:
+        return None
+    return _ALGORITHM.verify(signing_input, key, signature)
@@ -0,0 +1,23 @@
+"""Provides views exposing the state of the app."""
+from django.http import HttpRequest, HttpResponse
+
+from jwt_auth.metrics import get_collector
+
+# Content type of the Prometheus text exposition format.
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """Export the metrics of the authentication path for Prometheus.
+
+    Args:
+        request: The request.
+
+    Returns:
+        The metrics, or a 404 response if the current collector does not
+        keep them.
+    """
+    to_prometheus = getattr(get_collector(), 'to_prometheus', None)
+    if to_prometheus is None:
+        return HttpResponse(status=404)
+    return HttpResponse(to_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -10,5 +10,8 @@ setup(
         'django',
         'djangorestframework',
         'requests',
-    ]
+    ],
+    extras_require={
+        'async': ['httpx'],
+    },
 )